@@ -0,0 +1,254 @@
+"""Statistics over finished games.
+
+Every finished game is reduced once to a few counters (see game_rows) that
+are added to small SQLite tables with upserts:
+- stats_results: games by player count, role composition and result;
+- stats_survival: per role and night, how many players were alive when the
+  night began and how many of them died in it;
+- stats_saves: nights the doctor healed / the courtesan visited someone and
+  how many of those nights a mafia or maniac target survived thanks to them.
+
+Games are fed from archive records (archive.archive_record): when a game is
+archived, when an ended game is reset, and in bulk by backfill() for records
+archived before. A game is identified by (game_id, log_seq) and its key is
+inserted in the same transaction as its counters, so it is counted once even
+with several workers. /api/stats reads the aggregates only, never the games.
+"""
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from engine import ROLE_CIVIL, ROLE_COURTESAN, ROLE_DOCTOR
+from store import connect
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS stats_games ("
+    " key TEXT PRIMARY KEY,"
+    " ingested_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS stats_results ("
+    " players INTEGER NOT NULL,"
+    " composition TEXT NOT NULL,"
+    " result TEXT NOT NULL,"
+    " games INTEGER NOT NULL,"
+    " PRIMARY KEY (players, composition, result))",
+    "CREATE TABLE IF NOT EXISTS stats_survival ("
+    " players INTEGER NOT NULL,"
+    " role TEXT NOT NULL,"
+    " night INTEGER NOT NULL,"
+    " at_risk INTEGER NOT NULL,"
+    " died INTEGER NOT NULL,"
+    " PRIMARY KEY (players, role, night))",
+    "CREATE TABLE IF NOT EXISTS stats_saves ("
+    " players INTEGER NOT NULL,"
+    " role TEXT NOT NULL,"
+    " nights INTEGER NOT NULL,"
+    " saves INTEGER NOT NULL,"
+    " PRIMARY KEY (players, role))",
+)
+
+# check_end() results by their prefix
+RESULTS = (("Победа мафии", "mafia"), ("Победа мирных", "peace"), ("Ничья", "draw"))
+
+# Night summary lines written by finish_night from apply_night_and_get_deaths
+NIGHT_LINE = re.compile(r"^Ночь (\d+): (.*)$")
+HEALED = "Доктор лечил "
+VISITED = "Куртизанка была с "
+SURVIVED = re.compile(r" — ВЫЖИЛ \((спас доктор|спасла куртизанка)\)$")
+SAVERS = {"спас доктор": ROLE_DOCTOR, "спасла куртизанка": ROLE_COURTESAN}
+
+INGEST_BATCH = 500
+
+
+def result_kind(result: Optional[str]) -> str:
+    for prefix, kind in RESULTS:
+        if result and result.startswith(prefix):
+            return kind
+    return "unknown"
+
+
+def composition(roles: Dict[str, int]) -> str:
+    """{"Мафия": 2, "Доктор": 1, "Мирный житель": 7} -> "Мафия=2,Доктор=1", the simulate --roles syntax"""
+    return ",".join(f"{role}={count}" for role, count in roles.items() if count and role != ROLE_CIVIL)
+
+
+def record_key(record: dict) -> str:
+    return f"{record['game_id']}:{record.get('log_seq', 0)}"
+
+
+def night_saves(log: Iterable[str]) -> Dict[str, Tuple[int, int]]:
+    """Doctor and courtesan: (nights they protected someone, nights it saved a life)"""
+    protected = {ROLE_DOCTOR: set(), ROLE_COURTESAN: set()}
+    saved = {ROLE_DOCTOR: set(), ROLE_COURTESAN: set()}
+    for line in log:
+        m = NIGHT_LINE.match(line)
+        if m is None:
+            continue
+        night, text = int(m.group(1)), m.group(2)
+        if text.startswith(HEALED):
+            protected[ROLE_DOCTOR].add(night)
+        elif text.startswith(VISITED):
+            protected[ROLE_COURTESAN].add(night)
+        else:
+            survived = SURVIVED.search(text)
+            if survived is not None:
+                saved[SAVERS[survived.group(1)]].add(night)
+    return {role: (len(protected[role]), len(saved[role])) for role in protected}
+
+
+def survival(record: dict) -> Counter:
+    """(role, night, "at_risk" | "died") -> players, for one game.
+
+    A player is at risk in every night that began while they were alive.
+    Players whose death is not dated (games without history) are left out.
+    """
+    counts: Counter = Counter()
+    deaths = {d["name"]: d for d in record["deaths"]}
+    for p in record["players"]:
+        role = p["role"]
+        if not role:
+            continue
+        death = deaths.get(p["name"])
+        if death is None:
+            nights, died = record["night"], None
+        elif death.get("nights") is None:
+            continue
+        else:
+            nights = death["nights"]
+            died = death["number"] if death["phase"] == "night" else None
+        for night in range(1, nights + 1):
+            counts[(role, night, "at_risk")] += 1
+        if died is not None:
+            counts[(role, died, "died")] += 1
+    return counts
+
+
+def game_rows(record: dict) -> tuple:
+    """The counters one game adds: (results row, survival rows, saves rows)"""
+    players = len(record["players"])
+    result = (players, composition(record["roles"]), result_kind(record["result"]))
+    counts = survival(record)
+    nights = sorted({(role, night) for role, night, _ in counts})
+    survived = [(players, role, night, counts[(role, night, "at_risk")], counts[(role, night, "died")])
+                for role, night in nights]
+    saves = [(players, role, protected, saved)
+             for role, (protected, saved) in night_saves(record["log"]).items()
+             if record["roles"].get(role)]
+    return result, survived, saves
+
+
+class GameStats:
+    def __init__(self, path: str):
+        self.path = path
+        self.ingested = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Called with self._lock held
+        if self._db is None:
+            self._db = connect(self.path)
+            for statement in SCHEMA:
+                self._db.execute(statement)
+        return self._db
+
+    def ingest(self, record: dict) -> bool:
+        """Count a finished game; False if it was counted before"""
+        return self.ingest_many([record]) == 1
+
+    def ingest_many(self, records: Iterable[dict]) -> int:
+        """Count the games in one transaction, skipping those already counted"""
+        records = list(records)
+        if not records:
+            return 0
+        added = 0
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                for record in records:
+                    if db.execute("INSERT OR IGNORE INTO stats_games (key, ingested_at) VALUES (?, ?)",
+                                  (record_key(record), now)).rowcount == 0:
+                        continue
+                    result, survived, saves = game_rows(record)
+                    db.execute("INSERT INTO stats_results (players, composition, result, games) VALUES (?, ?, ?, 1) "
+                               "ON CONFLICT(players, composition, result) DO UPDATE SET games = games + 1", result)
+                    db.executemany(
+                        "INSERT INTO stats_survival (players, role, night, at_risk, died) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT(players, role, night) DO UPDATE SET "
+                        "at_risk = at_risk + excluded.at_risk, died = died + excluded.died", survived)
+                    db.executemany(
+                        "INSERT INTO stats_saves (players, role, nights, saves) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(players, role) DO UPDATE SET "
+                        "nights = nights + excluded.nights, saves = saves + excluded.saves", saves)
+                    added += 1
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        self.ingested += added
+        return added
+
+    def backfill(self, records: Iterable[dict], batch: int = INGEST_BATCH) -> dict:
+        """Bulk load, e.g. GameArchive.records(); games counted before are skipped"""
+        seen = added = 0
+        chunk: List[dict] = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= batch:
+                seen += len(chunk)
+                added += self.ingest_many(chunk)
+                chunk = []
+        seen += len(chunk)
+        added += self.ingest_many(chunk)
+        return {"ingested": added, "skipped": seen - added}
+
+    def summary(self, players: Optional[int] = None, limit: int = 20) -> dict:
+        """Win rates by player count and composition, survival by role and night, save rates"""
+        where, args = ("WHERE players = ?", (players,)) if players is not None else ("", ())
+        with self._lock:
+            db = self._conn()
+            results = db.execute(f"SELECT players, composition, result, games FROM stats_results {where}", args).fetchall()
+            survived = db.execute(f"SELECT role, night, SUM(at_risk), SUM(died) FROM stats_survival {where} "
+                                  "GROUP BY role, night ORDER BY role, night", args).fetchall()
+            saves = db.execute(f"SELECT role, SUM(nights), SUM(saves) FROM stats_saves {where} GROUP BY role",
+                               args).fetchall()
+
+        by_players: Dict[int, Counter] = {}
+        by_composition: Dict[tuple, Counter] = {}
+        for count, roles, kind, games in results:
+            by_players.setdefault(count, Counter())[kind] += games
+            by_composition.setdefault((count, roles), Counter())[kind] += games
+
+        def rates(results: Counter) -> dict:
+            games = sum(results.values())
+            return {
+                "games": games,
+                "mafia_win_rate": round(results["mafia"] / games, 4),
+                "peace_win_rate": round(results["peace"] / games, 4),
+                "draw_rate": round(results["draw"] / games, 4),
+            }
+
+        top = sorted(by_composition.items(), key=lambda item: sum(item[1].values()), reverse=True)[:limit]
+        survival_by_role: Dict[str, list] = {}
+        for role, night, at_risk, died in survived:
+            survival_by_role.setdefault(role, []).append({
+                "night": night, "at_risk": at_risk, "died": died, "survival": round(1 - died / at_risk, 4),
+            })
+        return {
+            "games": sum(sum(r.values()) for r in by_players.values()),
+            "by_players": [{"players": count, **rates(r)} for count, r in sorted(by_players.items())],
+            "compositions": [{"players": count, "roles": roles, **rates(r)} for (count, roles), r in top],
+            "survival": survival_by_role,
+            "saves": {role: {"nights": nights, "saves": saved, "rate": round(saved / nights, 4) if nights else None}
+                      for role, nights, saved in saves},
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
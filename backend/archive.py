@@ -0,0 +1,190 @@
+"""Cold storage for finished games.
+
+A game that reached END keeps its players, undo stack, log and event history
+in memory until it is evicted. The archiver thread turns ended games that
+nobody touched for a while into a compact record (see archive_record): roles,
+deaths by day and night, the final result, the log and the events. The record
+is stored zlib-compressed in its own SQLite file and the live game is deleted.
+
+The archive file is opened on first use, and records are only read and
+decompressed when asked for, so an instance that never archives pays nothing.
+"""
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Callable, Iterator, List, Optional
+
+import engine
+from engine import Game, event_to_list
+from store import connect
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS archive ("
+    " game_id TEXT PRIMARY KEY,"
+    " host_id INTEGER NOT NULL,"
+    " result TEXT,"
+    " players INTEGER NOT NULL,"
+    " archived_at REAL NOT NULL,"
+    " data BLOB NOT NULL)"
+)
+
+
+def undated_deaths(g: Game) -> List[dict]:
+    return [{"name": p.name, "role": p.role, "phase": None, "number": None, "nights": None}
+            for p in g.players.values() if not p.alive]
+
+
+def death_timeline(g: Game) -> List[dict]:
+    """Who died when: [{"name", "role", "phase": "day" | "night", "number", "nights"}] in order.
+
+    `nights` is how many nights had begun by then: a banshee cancels a night,
+    so the day number alone does not say it. Replays the event history and
+    watches alive flags, so undone deaths do not count. Without history only
+    the dead are known, with phase, number and nights None.
+    """
+    if not g.snapshots:
+        return undated_deaths(g)
+    replay = engine.rebuild(g, g.snapshots[0][0])
+    alive = {name for name, p in replay.players.items() if p.alive}
+    deaths = {}
+    current = ("day", replay.day)
+
+    def observe(event):
+        nonlocal alive, current
+        if event.command == "batch":
+            # Each command of a batch gets its own phase: a batch may finish the night and then vote
+            with engine.batch(replay):
+                for inner in event.args:
+                    observe(inner)
+            return
+        if event.command == "finish_night":
+            current = ("night", replay.night)
+        elif event.command == "day_vote":
+            current = ("day", replay.day)
+        # avenger_revenge keeps the phase of the death that triggered it
+
+        # Read before applying: a vote that ends the day also begins the next night
+        nights = replay.night
+        engine.apply_event(replay, event)
+        now_alive = {name for name, p in replay.players.items() if p.alive}
+        for name in alive - now_alive:
+            deaths[name] = (*current, nights)
+        for name in now_alive - alive:
+            deaths.pop(name, None)
+        alive = now_alive
+
+    for event in g.events[g.snapshots[0][0]:]:
+        observe(event)
+    return [{"name": name, "role": g.players[name].role if name in g.players else None,
+             "phase": phase, "number": number, "nights": nights}
+            for name, (phase, number, nights) in deaths.items()]
+
+
+def archive_record(g: Game) -> dict:
+    try:
+        deaths = death_timeline(g)
+    except Exception as e:
+        # A history that does not replay must not keep the game out of the archive
+        print(f"[archive] game {g.game_id}: history does not replay ({type(e).__name__}: {e}), deaths not dated")
+        deaths = undated_deaths(g)
+    return {
+        "game_id": g.game_id,
+        "host_id": g.host_id,
+        # Keeps growing across resets, so (game_id, log_seq) names one played game
+        "log_seq": g.log_next_seq,
+        "result": engine.check_end(g),
+        "day": g.day,
+        "night": g.night,
+        "roles": dict(g.role_counts),
+        "players": [
+            {"name": p.name, "role": p.role, "alive": p.alive, "is_mayor": p.is_mayor,
+             "is_successor": p.is_successor}
+            for p in g.players.values()
+        ],
+        "deaths": deaths,
+        "log": list(g.log_lines),
+        "events": [event_to_list(event) for event in g.events],
+    }
+
+
+class GameArchive:
+    def __init__(self, path: str, level: int = 9):
+        self.path = path
+        self.level = level
+        self.archived = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._job: Optional[threading.Thread] = None
+        self._job_stop = threading.Event()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Called with self._lock held
+        if self._db is None:
+            self._db = connect(self.path)
+            self._db.execute(SCHEMA)
+        return self._db
+
+    def put(self, record: dict) -> None:
+        data = zlib.compress(json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode(), self.level)
+        with self._lock:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO archive (game_id, host_id, result, players, archived_at, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (record["game_id"], record["host_id"], record["result"], len(record["players"]), time.time(), data),
+            )
+        self.archived += 1
+
+    def get(self, game_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn().execute("SELECT data FROM archive WHERE game_id = ?", (game_id,)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row is not None else None
+
+    def records(self, page: int = 500) -> Iterator[dict]:
+        """Every archived record, oldest first, read `page` rows at a time"""
+        last = 0
+        while True:
+            with self._lock:
+                rows = self._conn().execute("SELECT rowid, data FROM archive WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                                            (last, page)).fetchall()
+            if not rows:
+                return
+            for rowid, data in rows:
+                yield json.loads(zlib.decompress(data))
+            last = rows[-1][0]
+
+    def summaries(self, host_id: Optional[int] = None, limit: int = 50, before: Optional[float] = None) -> List[dict]:
+        """Newest first, without the compressed record; page with `before` = last archived_at"""
+        query = "SELECT game_id, host_id, result, players, archived_at FROM archive WHERE archived_at < ?"
+        args: list = [before if before is not None else float("inf")]
+        if host_id is not None:
+            query += " AND host_id = ?"
+            args.append(host_id)
+        query += " ORDER BY archived_at DESC LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            rows = self._conn().execute(query, args).fetchall()
+        keys = ("game_id", "host_id", "result", "players", "archived_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def start(self, job: Callable[[], int], interval: float = 60.0) -> None:
+        """Run job (archive what is due) every interval seconds in a thread"""
+        def loop():
+            while not self._job_stop.wait(interval):
+                try:
+                    job()
+                except Exception as e:
+                    print(f"[archive] archiving failed: {e}")
+
+        self._job = threading.Thread(target=loop, name="game-archiver", daemon=True)
+        self._job.start()
+
+    def close(self) -> None:
+        self._job_stop.set()
+        if self._job is not None:
+            self._job.join(timeout=5)
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
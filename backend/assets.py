@@ -0,0 +1,103 @@
+"""Static responses held in memory: the frontend page and /api/roles.
+
+An Asset is read and compressed once when the app starts: gzip always,
+brotli too when the brotli package is installed (pip install brotli). A
+request gets the best encoding its Accept-Encoding allows, with the ETag
+of that encoding: a hash of the content, suffixed with the encoding for the
+compressed bodies ("hash-gzip"), so caches never take one body for another.
+If-None-Match with the tag of any encoding gets a 304, since they all decode
+to the same content. Responses carry the Cache-Control the asset was created
+with.
+"""
+import gzip
+import hashlib
+import os
+from typing import Dict, Optional
+
+from fastapi import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Preferred first when the client accepts several with the same q
+ENCODINGS = ("br", "gzip")
+
+
+def etag_matches(if_none_match: Optional[str], *etags: str) -> bool:
+    """Whether If-None-Match names any of `etags`; weak comparison: W/ prefixes are ignored"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == "*" or tag in etags:
+            return True
+    return False
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> Dict[str, float]:
+    """"gzip, br;q=0.8" -> {"gzip": 1.0, "br": 0.8}"""
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+class Asset:
+    def __init__(self, body: bytes, media_type: str, cache_control: str):
+        self.media_type = media_type
+        self.cache_control = cache_control
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        self.variants: Dict[str, bytes] = {"identity": body}
+        compressed = {"gzip": gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(body, quality=11)
+        for encoding, data in compressed.items():
+            # Tiny bodies do not shrink
+            if len(data) < len(body):
+                self.variants[encoding] = data
+        # A strong ETag names one body: each encoding has its own
+        self.etags: Dict[str, str] = {
+            encoding: f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"'
+            for encoding in self.variants
+        }
+
+    @classmethod
+    def from_file(cls, path: str, media_type: str, cache_control: str) -> Optional["Asset"]:
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            return cls(f.read(), media_type, cache_control)
+
+    def encoding_for(self, accept_encoding: Optional[str]) -> str:
+        accepted = accepted_encodings(accept_encoding)
+        best, best_q = "identity", 0.0
+        for encoding in ENCODINGS:
+            q = accepted.get(encoding, accepted.get("*", 0.0))
+            if encoding in self.variants and q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    def response(self, accept_encoding: Optional[str], if_none_match: Optional[str]) -> Response:
+        encoding = self.encoding_for(accept_encoding)
+        headers = {"ETag": self.etags[encoding], "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if etag_matches(if_none_match, *self.etags.values()):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
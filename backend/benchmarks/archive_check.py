@@ -0,0 +1,84 @@
+"""Check: one bad game does not stop an archive pass.
+
+Plays a few full games, breaks the history of one of them (an event that
+does not replay) and makes archiving another fail outright, then runs one
+archive pass (main.archive_ended_games) against a temporary archive file.
+Every game but the failing one must be archived. The game whose history
+does not replay is archived too, with its deaths undated; the others keep
+their dates. The failing game stays in the store and is archived by the
+next pass once it can be.
+
+    python -m benchmarks.archive_check [--games 6]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+import main
+from analytics import GameStats
+from archive import GameArchive
+from engine import Event
+
+from .common import AsgiClient, play_game
+
+
+async def play(games: int):
+    client = AsgiClient(main.app)
+    return [await play_game(client, seed=i, host_id=i) for i in range(games)]
+
+
+def check(games: int) -> int:
+    errors = []
+    with tempfile.TemporaryDirectory() as tmp:
+        main.ARCHIVE = GameArchive(os.path.join(tmp, "archive.db"))
+        main.STATS = GameStats(main.ARCHIVE.path)
+        main.ARCHIVE_AFTER = 0.0
+        ids = asyncio.run(play(games))
+        broken, failing = ids[0], ids[1]
+        main.STORE.get(broken).events.append(Event("day_vote", ("Никого нет",)))
+        put = main.ARCHIVE.put
+
+        def put_failing(record: dict):
+            if record["game_id"] == failing:
+                raise OSError("disk full")
+            put(record)
+
+        main.ARCHIVE.put = put_failing
+        archived = main.archive_ended_games()
+        if archived != games - 1:
+            errors.append(f"first pass archived {archived} games, expected {games - 1}")
+        if main.STORE.get(failing) is None:
+            errors.append("the game that failed to archive was deleted")
+        record = main.ARCHIVE.get(broken)
+        if record is None:
+            errors.append("the game whose history does not replay was not archived")
+        elif any(d["phase"] is not None for d in record["deaths"]) or not record["deaths"]:
+            errors.append("the game whose history does not replay has dated deaths")
+        for game_id in ids[2:]:
+            record = main.ARCHIVE.get(game_id)
+            if record is None or any(d["phase"] is None for d in record["deaths"]):
+                errors.append(f"game {game_id} was not archived with dated deaths")
+
+        main.ARCHIVE.put = put
+        if main.archive_ended_games() != 1 or main.ARCHIVE.get(failing) is None:
+            errors.append("the next pass did not archive the game that failed")
+        main.ARCHIVE.close()
+        main.STATS.close()
+    for error in errors:
+        print(f"  {error}")
+    print(f"{games} games, {len(errors)} problems")
+    return len(errors)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--games", type=int, default=6)
+    args = parser.parse_args()
+    if check(args.games):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,195 @@
+"""Shared helpers for benchmarks: in-process ASGI client and a scripted game.
+
+Run benchmarks from the backend directory, e.g.
+    python -m benchmarks.store_backends
+"""
+import asyncio
+import json
+import random
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+
+class AsgiClient:
+    """Minimal HTTP client that calls an ASGI app directly (no sockets)"""
+
+    def __init__(self, app):
+        self.app = app
+        self.requests = 0
+
+    async def request(self, method: str, url: str, body: Union[dict, bytes, None] = None,
+                      headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], bytes]:
+        """A dict body is sent as JSON, bytes as they are"""
+        parts = urlsplit(url)
+        if isinstance(body, bytes):
+            raw_body = body
+        else:
+            raw_body = json.dumps(body).encode() if body is not None else b""
+        raw_headers = [(b"host", b"bench")]
+        if isinstance(body, dict):
+            raw_headers.append((b"content-type", b"application/json"))
+        for k, v in (headers or {}).items():
+            raw_headers.append((k.lower().encode(), v.encode()))
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": parts.path,
+            "raw_path": parts.path.encode(),
+            "query_string": parts.query.encode(),
+            "headers": raw_headers,
+            "client": ("127.0.0.1", 0),
+            "server": ("bench", 80),
+        }
+        sent = False
+        responded = asyncio.Event()
+        status = 0
+        resp_headers: Dict[str, str] = {}
+        chunks: List[bytes] = []
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": raw_body, "more_body": False}
+            # Streaming responses watch for a disconnect; the client stays until the body is complete
+            await responded.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                for k, v in message.get("headers", []):
+                    resp_headers[k.decode().lower()] = v.decode()
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    responded.set()
+
+        await self.app(scope, receive, send)
+        self.requests += 1
+        return status, resp_headers, b"".join(chunks)
+
+    async def call(self, method: str, url: str, body: Optional[dict] = None) -> dict:
+        status, _, data = await self.request(method, url, body)
+        if status >= 400:
+            raise RuntimeError(f"{method} {url} -> {status}: {data.decode()}")
+        return json.loads(data) if data else {}
+
+
+DEFAULT_ROLES = {
+    "Мафия": 2,
+    "Комиссар": 1,
+    "Монах": 1,
+    "Гадалка": 1,
+    "Мститель": 1,
+}
+
+
+async def play_game(client, n_players: int = 10, seed: int = 0, host_id: int = 1) -> str:
+    """Play a full game from create_game to END through the HTTP API.
+
+    Like the frontend, state is refetched after every action.
+    Returns the game id.
+    """
+    rnd = random.Random(seed)
+    game_id = (await client.call("POST", "/api/game/create", {"host_id": host_id}))["game_id"]
+    base = f"/api/game/{game_id}"
+
+    names = [f"Игрок {i + 1}" for i in range(n_players)]
+    for name in names:
+        await client.call("POST", f"{base}/add_player", {"player_name": name})
+
+    roles = dict(DEFAULT_ROLES)
+    roles["Мирный житель"] = n_players - 3 - sum(roles.values())
+    for role, count in roles.items():
+        await client.call("POST", f"{base}/set_role_count", {"role": role, "count": count})
+    await client.call("POST", f"{base}/start")
+
+    state = await client.call("GET", base)
+    for role in state["bind_remaining"]:
+        while state["bind_remaining"][role] > 0:
+            await client.call("POST", f"{base}/bind_role", {"role": role})
+            player = rnd.choice(state["bind_available_players"])
+            await client.call("POST", f"{base}/bind_player", {"player_name": player})
+            state = await client.call("GET", base)
+
+    await client.call("POST", f"{base}/select_mayor", {"player_name": names[0]})
+    await client.call("POST", f"{base}/select_successor", {"player_name": names[1]})
+
+    for _ in range(1000):
+        state = await client.call("GET", base)
+        stage = state["stage"]
+        alive = [p["name"] for p in state["players"] if p["alive"]]
+
+        if stage == "END":
+            return game_id
+        if stage == "DAY_MENU":
+            if state["is_mourning_day"]:
+                await client.call("POST", f"{base}/skip_to_night")
+            else:
+                await client.call("POST", f"{base}/day_vote_start")
+        elif stage == "DAY_VOTE_PICK":
+            targets = [n for n in alive if n not in state["protected_today"]]
+            await client.call("POST", f"{base}/day_vote", {"target": rnd.choice(targets)})
+        elif stage == "AVENGER_REVENGE_PICK":
+            targets = [n for n in alive if n != state["avenger_pending"]]
+            await client.call("POST", f"{base}/avenger_revenge", {"target": rnd.choice(targets)})
+        elif stage == "NIGHT_MENU":
+            if state["current_step"] is None:
+                await client.call("POST", f"{base}/finish_night")
+            elif state["current_step_is_yesno"]:
+                await client.call("POST", f"{base}/night_action", {"choice": rnd.random() < 0.5})
+            else:
+                targets = state["current_step_targets"] or alive
+                await client.call("POST", f"{base}/night_action", {"target": rnd.choice(targets)})
+        else:
+            raise RuntimeError(f"Unexpected stage {stage}")
+
+    raise RuntimeError("Game did not finish")
+
+
+class AsgiWebSocket:
+    """In-process WebSocket client for an ASGI app"""
+
+    def __init__(self, app, path: str):
+        self.app = app
+        self.path = path
+        self._to_app: "asyncio.Queue[dict]" = asyncio.Queue()
+        self._from_app: "asyncio.Queue[dict]" = asyncio.Queue()
+        self._task = None
+
+    async def connect(self) -> bool:
+        scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": self.path,
+            "raw_path": self.path.encode(),
+            "query_string": b"",
+            "headers": [(b"host", b"bench")],
+            "subprotocols": [],
+            "client": ("127.0.0.1", 0),
+            "server": ("bench", 80),
+        }
+        self._task = asyncio.create_task(self.app(scope, self._to_app.get, self._from_app.put))
+        await self._to_app.put({"type": "websocket.connect"})
+        msg = await self._from_app.get()
+        return msg["type"] == "websocket.accept"
+
+    async def send_json(self, data: dict):
+        await self._to_app.put({"type": "websocket.receive", "text": json.dumps(data)})
+
+    async def receive_json(self) -> dict:
+        msg = await self._from_app.get()
+        if msg["type"] != "websocket.send":
+            raise RuntimeError(f"socket closed: {msg}")
+        return json.loads(msg["text"])
+
+    async def close(self):
+        await self._to_app.put({"type": "websocket.disconnect", "code": 1000})
+        await self._task
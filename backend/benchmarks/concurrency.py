@@ -0,0 +1,192 @@
+"""Parallel mutations: a stress check on one game and throughput over many.
+
+Sync endpoints run in Starlette's threadpool, so requests to one game really
+run at the same time.
+
+stress: a game at night gets bursts of parallel night_action and undo calls.
+Each burst starts its threads together at a barrier and calls the endpoint
+functions directly: over HTTP the event loop spends longer dispatching a
+request than the mutation takes, and overlaps would be rare. After every
+burst the game must be consistent:
+- every successful request bumped the version once, a refused one not at all;
+- every successful request recorded exactly one event;
+- replaying the events (engine.rebuild) gives the same state;
+- the alive counters agree with the players.
+The thread switch interval is lowered to make interleavings likely.
+
+throughput: the same request mix through main.app over ASGI from many
+workers, each on its own game and then all on one game. Games do not block
+each other, requests to one game wait for its lock.
+
+    python -m benchmarks.concurrency [stress|throughput|all] [--bursts 50] [--games 200] [--requests 20000]
+"""
+import argparse
+import asyncio
+import functools
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from fastapi import HTTPException
+
+import engine
+import main
+from engine import Game, Stage
+
+from .common import AsgiClient
+from .game_state import night_game
+
+
+def new_night_game(game_id: str, players: int = 12, seed: int = 0) -> Game:
+    """A game in the first NIGHT_MENU, recording events from now on"""
+    g = night_game(players, 1, seed)
+    g.game_id = game_id
+    g.history = True
+    main.STORE.put(g)
+    return g
+
+
+def check_invariants(g: Game, version_before: int, events_before: int, succeeded: int) -> List[str]:
+    errors = []
+    if g.version != version_before + succeeded:
+        errors.append(f"version {g.version}, expected {version_before + succeeded}")
+    if len(g.events) != events_before + succeeded:
+        errors.append(f"{len(g.events)} events, expected {events_before + succeeded}")
+    try:
+        if engine.state_json(engine.rebuild(g)) != engine.state_json(g):
+            errors.append("replaying the events gives another state")
+    except engine.GameError as e:
+        errors.append(f"the events do not replay: {e.detail}")
+    alive = [p for p in g.players.values() if p.alive]
+    if g.alive_count() != len(alive) or g.mafia_alive_count() != sum(engine.is_mafia_role(p.role) for p in alive):
+        errors.append("alive counters out of sync")
+    return errors
+
+
+def advance(g: Game):
+    """Finish the night and vote someone out, back to the next NIGHT_MENU (or END)"""
+    def step():
+        while g.stage == Stage.NIGHT_MENU and g.night_step_index < len(g.night_steps):
+            engine.night_action(g, target=next(n for n, p in g.players.items() if p.alive), choice=False)
+        if g.stage == Stage.NIGHT_MENU:
+            engine.finish_night(g)
+        while g.stage not in (Stage.NIGHT_MENU, Stage.END):
+            if g.stage == Stage.DAY_MENU and g.skip_vote_day == g.day:
+                engine.skip_to_night(g)
+            elif g.stage == Stage.DAY_MENU:
+                engine.day_vote_start(g)
+            elif g.stage == Stage.DAY_VOTE_PICK:
+                engine.day_vote(g, next(n for n, p in g.players.items()
+                                        if p.alive and not p.is_mayor and g.protected_from_vote_day.get(n) != g.day))
+            elif g.stage == Stage.AVENGER_REVENGE_PICK:
+                engine.avenger_revenge(g, next(n for n, p in g.players.items() if p.alive and n != g.avenger_pending))
+            else:
+                raise RuntimeError(f"Unexpected stage {g.stage}")
+
+    main.STORE.mutate(g.game_id, step)
+
+
+def mixed_requests(game_id: str, target: str, count: int, rnd: random.Random) -> List[tuple]:
+    """night_action twice as often as undo; a night_action never fails after pushing an undo entry"""
+    body = {"target": target, "choice": False}
+    return [("POST", f"/api/game/{game_id}/night_action", body) if rnd.random() < 2 / 3
+            else ("POST", f"/api/game/{game_id}/undo", None)
+            for _ in range(count)]
+
+
+def parallel_burst(game_id: str, target: str, size: int, rnd: random.Random) -> int:
+    """Call night_action / undo from `size` threads at once, returns how many succeeded"""
+    req = main.NightActionRequest(target=target, choice=False)
+    calls = [functools.partial(main.night_action, game_id=game_id, req=req) if rnd.random() < 2 / 3
+             else functools.partial(main.undo_action, game_id=game_id)
+             for _ in range(size)]
+    barrier = threading.Barrier(size)
+
+    def run(call) -> bool:
+        barrier.wait()
+        try:
+            call()
+            return True
+        except HTTPException as e:
+            if e.status_code != 400:
+                raise
+            return False
+
+    with ThreadPoolExecutor(size) as pool:
+        return sum(pool.map(run, calls))
+
+
+def stress(bursts: int, burst_size: int, seed: int) -> int:
+    rnd = random.Random(seed)
+    g = new_night_game("stress", seed=seed)
+    failures = 0
+    for n in range(bursts):
+        if g.stage == Stage.END:
+            g = new_night_game(f"stress-{n}", seed=seed + n)
+        version, events = g.version, len(g.events)
+        target = next(name for name, p in g.players.items() if p.alive)
+        succeeded = parallel_burst(g.game_id, target, burst_size, rnd)
+        g = main.STORE.get(g.game_id)
+        errors = check_invariants(g, version, events, succeeded)
+        if errors:
+            failures += 1
+            print(f"  burst {n}: " + "; ".join(errors))
+        advance(g)
+    return failures
+
+
+async def throughput(client: AsgiClient, game_ids: List[str], workers: int, total: int) -> float:
+    per_worker = total // workers
+
+    async def worker(i: int):
+        game_id = game_ids[i % len(game_ids)]
+        target = next(name for name, p in main.STORE.get(game_id).players.items() if p.alive)
+        for method, url, body in mixed_requests(game_id, target, per_worker, random.Random(i)):
+            status, _, data = await client.request(method, url, body)
+            if status not in (200, 400):
+                raise RuntimeError(f"{url} -> {status}: {data.decode()}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(workers)))
+    return per_worker * workers / (time.perf_counter() - start)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", nargs="?", default="all", choices=("stress", "throughput", "all"))
+    parser.add_argument("--bursts", type=int, default=50)
+    parser.add_argument("--burst-size", type=int, default=40)
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    client = AsgiClient(main.app)
+    print(f"store: {type(main.STORE).__name__}")
+
+    if args.mode in ("stress", "all"):
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            failures = stress(args.bursts, args.burst_size, args.seed)
+        finally:
+            sys.setswitchinterval(interval)
+        print(f"stress: {args.bursts} bursts of {args.burst_size} parallel requests at one game, "
+              f"{failures} inconsistent")
+        if failures:
+            sys.exit(1)
+
+    if args.mode in ("throughput", "all"):
+        game_ids = [new_night_game(f"throughput-{i}", seed=i).game_id for i in range(args.games)]
+        results = {}
+        for label, ids in ((f"{args.games} games", game_ids), ("1 game", game_ids[:1])):
+            results[label] = asyncio.run(throughput(client, ids, args.games, args.requests))
+            print(f"throughput, {args.games} workers on {label}: {results[label]:.0f} mutations/s")
+        print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main_cli()
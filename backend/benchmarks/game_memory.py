@@ -0,0 +1,93 @@
+"""Memory held per game with many games open at once.
+
+Each game gets its own player names, is dealt the default roles and played
+through day 1 and the first night, so it carries bound roles, a log and an
+undo stack like a live table. Memory is measured with tracemalloc around the
+whole batch and reported per game.
+
+    python -m benchmarks.game_memory [--games 10,50,100000] [--players 10]
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+import engine
+import main
+from benchmarks.common import DEFAULT_ROLES
+from main import (
+    AddPlayerRequest, BindPlayerRequest, BindRoleRequest, CreateGameRequest, NightActionRequest,
+    SelectMayorRequest, SelectSuccessorRequest, SetRoleCountRequest, VoteRequest,
+)
+
+
+def play_first_night(index: int, players: int, rnd: random.Random) -> str:
+    game_id = main.create_game(req=CreateGameRequest(host_id=index))["game_id"]
+    # Every table has its own players
+    names = [f"Игрок {index}-{i + 1}" for i in range(players)]
+    for name in names:
+        main.add_player(game_id=game_id, req=AddPlayerRequest(player_name=name))
+    roles = dict(DEFAULT_ROLES)
+    roles[engine.ROLE_CIVIL] = players - 3 - sum(roles.values())
+    for role, count in roles.items():
+        main.set_role_count(game_id=game_id, req=SetRoleCountRequest(role=role, count=count))
+    main.start_game(game_id=game_id)
+
+    g = main.get_game(game_id)
+    for role, count in list(g.bind_remaining.items()):
+        for _ in range(count):
+            main.bind_role(game_id=game_id, req=BindRoleRequest(role=role))
+            player = rnd.choice(g.bind_available_players)
+            main.bind_player(game_id=game_id, req=BindPlayerRequest(player_name=player))
+    main.select_mayor(game_id=game_id, req=SelectMayorRequest(player_name=names[0]))
+    main.select_successor(game_id=game_id, req=SelectSuccessorRequest(player_name=names[1]))
+
+    voted = next(p.name for p in g.players.values()
+                 if p.role != engine.ROLE_AVENGER and g.protected_from_vote_day.get(p.name) != g.day)
+    main.day_vote_start(game_id=game_id)
+    main.day_vote(game_id=game_id, req=VoteRequest(target=voted))
+    while g.stage == engine.Stage.NIGHT_MENU and g.night_step_index < len(g.night_steps):
+        step = g.night_steps[g.night_step_index]
+        if step in engine.YESNO_STEPS:
+            req = NightActionRequest(choice=rnd.random() < 0.5)
+        else:
+            req = NightActionRequest(target=rnd.choice(engine.cached_step_targets(g, step) or g.alive_names()))
+        main.night_action(game_id=game_id, req=req)
+    if g.stage == engine.Stage.NIGHT_MENU:
+        main.finish_night(game_id=game_id)
+    return game_id
+
+
+def measure(games: int, players: int) -> dict:
+    rnd = random.Random(games)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    game_ids = [play_first_night(i, players, rnd) for i in range(games)]
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    for game_id in game_ids:
+        main.STORE.delete(game_id)
+    return {"games": games, "bytes_per_game": used // games, "total_mb": used / 2 ** 20, "seconds": elapsed}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--games", default="10,50,100000", help="comma-separated game counts")
+    parser.add_argument("--players", type=int, default=10)
+    args = parser.parse_args()
+
+    # The default cap would unload games while the batch is being measured
+    main.STORE.max_games = None
+    print(f"{'games':>7} {'bytes/game':>10} {'total MB':>9} {'setup s':>8}")
+    for games in map(int, args.games.split(",")):
+        r = measure(games, args.players)
+        print(f"{r['games']:>7} {r['bytes_per_game']:>10} {r['total_mb']:>9.1f} {r['seconds']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,158 @@
+"""GET /api/game/{id} on a 20-player game at night 10.
+
+Compares, per request:
+- the previous path: build_game_state() returned as a dict, which FastAPI
+  runs through jsonable_encoder and json.dumps (served here by a temporary
+  route with the old endpoint body);
+- the cached path: encoded_game_state() bytes, built once per game version
+  and sent as they are;
+and, without HTTP, the cost of building and encoding the state alone with
+the stdlib and with orjson when it is installed. Last, --spectators threads
+read the state together right after each new version, as polling clients
+do after a move, with a short thread switch interval so that they overlap;
+concurrent misses share one encoding (main.STATE_FLIGHTS).
+
+    python -m benchmarks.game_state [--players 20] [--night 10] [--requests 2000] [--spectators 8]
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi.encoders import jsonable_encoder
+
+import engine
+import main
+import simulate
+from engine import Game, Stage
+
+from .common import AsgiClient
+
+
+def night_game(players: int, night: int, seed: int = 0) -> Game:
+    """A game of the given size in the NIGHT_MENU of `night`.
+
+    Days vote out a civilian; at night every step picks the doctor's patient
+    where it can, so most kills are saved and the game lasts that long.
+    """
+    rnd = random.Random(seed)
+    g = simulate.setup_game(simulate.parse_roles("", players), players, rnd)
+    g.game_id = "bench-game-state"
+    while True:
+        if g.stage == Stage.DAY_MENU:
+            if g.skip_vote_day == g.day:
+                engine.skip_to_night(g)
+                continue
+            engine.day_vote_start(g)
+            civilians = [p.name for p in g.players.values()
+                         if p.alive and p.role == engine.ROLE_CIVIL and not p.is_mayor and not p.is_successor
+                         and g.protected_from_vote_day.get(p.name) != g.day]
+            engine.day_vote(g, civilians[0])
+        elif g.stage == Stage.NIGHT_MENU:
+            if g.night == night:
+                return g
+            while g.night_step_index < len(g.night_steps):
+                step = g.night_steps[g.night_step_index]
+                if step in engine.YESNO_STEPS:
+                    engine.night_action(g, choice=False)
+                else:
+                    targets = engine.cached_step_targets(g, step)
+                    doctor = g.get_role_owner(engine.ROLE_DOCTOR)
+                    pick = next((name for name in targets if name != doctor), targets[0]) if targets else None
+                    engine.night_action(g, target=g.night_choices.doctor_target or pick)
+            engine.finish_night(g)
+        else:
+            raise RuntimeError(f"Game left the day/night loop at {g.stage} (day {g.day}, night {g.night})")
+
+
+def per_call(fn, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+async def per_request(client: AsgiClient, url: str, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        status, _, _ = await client.request("GET", url)
+        assert status == 200, status
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--night", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--spectators", type=int, default=8)
+    args = parser.parse_args()
+
+    g = night_game(args.players, args.night)
+    main.STORE.put(g)
+    full = main.encoded_game_state(g)
+    slim = main.encoded_game_state(g, slim=True)
+    print(f"{args.players} players, night {g.night}, day {g.day}, {len(g.log_lines)} log lines; "
+          f"state {len(full)} bytes, slim {len(slim)} bytes; orjson {'yes' if main.orjson else 'not installed'}")
+
+    @main.app.get("/bench/legacy_state/{game_id}")
+    def legacy_game_state(game_id: str, slim: bool = False):
+        return main.build_game_state(main.get_game(game_id), slim)
+
+    assert json.loads(full) == jsonable_encoder(main.build_game_state(g))
+
+    n = args.requests
+    print("\nencoding only, us per call")
+    print(f"  {'build_game_state':<44} {per_call(lambda: main.build_game_state(g), n):>8.1f}")
+    print(f"  {'build + jsonable_encoder + json.dumps':<44} "
+          f"{per_call(lambda: json.dumps(jsonable_encoder(main.build_game_state(g)), ensure_ascii=False), n):>8.1f}")
+    print(f"  {'build + json.dumps (fallback without orjson)':<44} "
+          f"{per_call(lambda: json.dumps(main.build_game_state(g), ensure_ascii=False).encode(), n):>8.1f}")
+    if main.orjson is not None:
+        print(f"  {'build + orjson':<44} {per_call(lambda: main.orjson.dumps(main.build_game_state(g)), n):>8.1f}")
+
+    def uncached():
+        g.encoded_state = None
+        return main.encoded_game_state(g)
+
+    print(f"  {'encoded_game_state, new version':<44} {per_call(uncached, n):>8.1f}")
+    print(f"  {'encoded_game_state, cached':<44} {per_call(lambda: main.encoded_game_state(g), n):>8.1f}")
+
+    client = AsgiClient(main.app)
+    print("\nGET through the app (ASGI, no sockets), us per request")
+    for query in ("", "?slim=true"):
+        legacy = asyncio.run(per_request(client, f"/bench/legacy_state/{g.game_id}{query}", n))
+        cached = asyncio.run(per_request(client, f"/api/game/{g.game_id}{query}", n))
+        label = "slim" if query else "full"
+        print(f"  {label}: previous {legacy:8.1f}   cached {cached:8.1f}   x{legacy / cached:.1f}")
+
+    moves = max(1, n // 10)
+    barrier = threading.Barrier(args.spectators)
+
+    def spectator(_):
+        for _ in range(moves):
+            if barrier.wait() == 0:
+                g.version += 1  # a move, as far as the cache is concerned
+            barrier.wait()
+            main.encoded_game_state(g)
+
+    computed, coalesced = main.STATE_FLIGHTS.computed, main.STATE_FLIGHTS.coalesced
+    # Switch threads often, as if the readers ran on several cores
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(args.spectators) as pool:
+            list(pool.map(spectator, range(args.spectators)))
+    finally:
+        sys.setswitchinterval(interval)
+    computed, coalesced = main.STATE_FLIGHTS.computed - computed, main.STATE_FLIGHTS.coalesced - coalesced
+    print(f"\n{args.spectators} spectators x {moves} moves: {computed} encodings, {coalesced} reads coalesced, "
+          f"{moves * args.spectators - computed - coalesced} served from the cache")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,81 @@
+"""Differential check: replaying the recorded history gives the live game.
+
+Plays random games through the engine like index_check, and in between
+sends commands the rules refuse: a night action without a target or a
+choice, votes and picks for players who do not exist, an empty name.
+A refused command is not recorded, so it must leave no trace in the game,
+in particular no undo checkpoint that a later undo would pop. After every
+move, accepted or refused, engine.rebuild() of the history must give the
+state of the live game.
+
+    python -m benchmarks.history_check [--games 200] [--moves 300] [--seed 0]
+"""
+import argparse
+import random
+import sys
+
+import engine
+from engine import Game, GameError, Stage
+
+from .index_check import new_game, random_move
+
+
+def refused_move(g: Game):
+    """A command with arguments that the current stage must refuse"""
+    stage = g.stage
+    if stage == Stage.NIGHT_MENU:
+        return engine.night_action(g, target=None, choice=None)
+    if stage == Stage.DAY_VOTE_PICK:
+        return engine.day_vote(g, "Никто")
+    if stage == Stage.MAYOR_SELECT:
+        return engine.select_mayor(g, "Никто")
+    if stage == Stage.SUCCESSOR_SELECT:
+        return engine.select_successor(g, "Никто")
+    if stage == Stage.AVENGER_REVENGE_PICK:
+        return engine.avenger_revenge(g, "Никто")
+    if stage == Stage.NIGHT0_BIND_PLAYER:
+        return engine.bind_player(g, "Никто")
+    return engine.add_player(g, " ")
+
+
+def check(games: int, moves: int, seed: int) -> int:
+    checks = failures = 0
+    for n in range(games):
+        rnd = random.Random(seed + n)
+        g = new_game(rnd)
+        for move in range(moves):
+            refused = rnd.random() < 0.25
+            try:
+                refused_move(g) if refused else random_move(g, rnd, move)
+            except GameError:
+                pass
+            if not g.snapshots:
+                continue
+            checks += 1
+            try:
+                replayed = engine.state_json(engine.rebuild(g))
+            except GameError as e:
+                replayed = f"replay failed: {e.detail}"
+            if replayed != engine.state_json(g):
+                failures += 1
+                print(f"  game {n}, move {move} ({g.stage}, {'refused' if refused else 'random'} move): "
+                      f"the history replays to another state")
+                break
+            if g.stage == Stage.END:
+                break
+    print(f"{games} games, {checks} checks, {failures} games diverged")
+    return failures
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--moves", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if check(args.games, args.moves, args.seed):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
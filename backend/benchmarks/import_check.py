@@ -0,0 +1,73 @@
+"""Check: importing over a game never reuses an older version.
+
+For each store backend: exports a game, changes it further, remembers its
+ETag, then imports the exported (older) copy with overwrite=true. The
+imported game must get a version newer than the replaced one, so a client
+revalidating with the old ETag gets the imported state instead of a 304.
+
+    python -m benchmarks.import_check
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+import main
+
+from .common import AsgiClient
+
+ADMIN = {"X-Admin-Token": "import-check"}
+
+
+async def check_store(client: AsgiClient) -> list:
+    errors = []
+    game_id = (await client.call("POST", "/api/game/create", {"host_id": 1}))["game_id"]
+    base = f"/api/game/{game_id}"
+    for i in range(3):
+        await client.call("POST", f"{base}/add_player", {"player_name": f"Игрок {i + 1}"})
+    status, _, exported = await client.request("GET", "/api/admin/export", headers=ADMIN)
+    if status != 200:
+        return [f"export -> {status}"]
+    for i in range(3, 5):
+        await client.call("POST", f"{base}/add_player", {"player_name": f"Игрок {i + 1}"})
+    _, headers, _ = await client.request("GET", base)
+    etag = headers["etag"]
+
+    status, _, body = await client.request("POST", "/api/admin/import?overwrite=true", exported,
+                                           headers={**ADMIN, "Content-Type": "application/x-ndjson"})
+    if status != 200:
+        return [f"import -> {status}: {body.decode()}"]
+    status, headers, body = await client.request("GET", base, headers={"If-None-Match": etag})
+    if status != 200:
+        errors.append(f"the ETag {etag} of the replaced game still matches ({status})")
+    elif int(headers["etag"].strip('"')) <= int(etag.strip('"')):
+        errors.append(f"the imported game has version {headers['etag']}, the replaced one had {etag}")
+    return errors
+
+
+def check() -> int:
+    main.ADMIN_TOKEN = ADMIN["X-Admin-Token"].encode()
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in ("memory", "sqlite", "shared"):
+            os.environ["MAFIA_STORE"] = backend
+            os.environ["MAFIA_DB_PATH"] = os.path.join(tmp, f"{backend}.db")
+            main.STORE = main.make_store()
+            try:
+                errors = asyncio.run(check_store(AsgiClient(main.app)))
+            finally:
+                main.STORE.close()
+            for error in errors:
+                print(f"  {backend}: {error}")
+            print(f"{backend:<8} {'ok' if not errors else 'FAILED'}")
+            failures += bool(errors)
+    return failures
+
+
+def main_cli():
+    if check():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,161 @@
+"""Property check: the alive counters and role-owner index on Game agree with scans.
+
+Game keeps alive counts per faction and a role -> alive owners index up to
+date on every change to `alive` or `role` (deaths, the rat conversion,
+binding, players added and removed, undo). This plays random games through
+the engine: random compositions, random moves at every stage, undo, and
+players added and removed at any time, most of them refused by the rules.
+After every move each indexed query is compared with the answer of a plain
+scan over the players, also on a copy decoded from game_to_json, which
+rebuilds the index from scratch.
+
+    python -m benchmarks.index_check [--games 300] [--moves 400] [--seed 0]
+"""
+import argparse
+import random
+import sys
+from typing import List, Optional
+
+import engine
+from engine import Game, GameError, Stage
+
+ROLES = engine.ALL_ROLES_ORDER + [engine.ROLE_RAT_MAFIA]
+OPTIONAL_ROLES = {engine.ROLE_AVENGER, engine.ROLE_IMMORTAL, engine.ROLE_RAT, engine.ROLE_COMMISSIONER,
+                  engine.ROLE_DUKE, engine.ROLE_BANSHEE, engine.ROLE_MANIAC, engine.ROLE_MONK, engine.ROLE_SEER}
+
+
+def scan_role_owner(g: Game, role: str) -> Optional[str]:
+    return next((p.name for p in g.players.values() if p.alive and p.role == role), None)
+
+
+def mismatches(g: Game) -> List[str]:
+    """Indexed answers that differ from the scan"""
+    players = list(g.players.values())
+    expected = {
+        "alive_count": sum(p.alive for p in players),
+        "mafia_alive_count": sum(p.alive and engine.is_mafia_role(p.role) for p in players),
+        "peace_alive_count": sum(p.alive and engine.is_peace_role(p.role) for p in players),
+        "maniac_alive": any(p.alive and p.role == engine.ROLE_MANIAC for p in players),
+    }
+    errors = [f"{name}() = {getattr(g, name)()}, scan gives {value}"
+              for name, value in expected.items() if getattr(g, name)() != value]
+    for role in ROLES:
+        if g.role_alive_exists(role) != any(p.alive and p.role == role for p in players):
+            errors.append(f"role_alive_exists({role})")
+        owner = scan_role_owner(g, role)
+        if g.get_role_owner(role) != owner:
+            errors.append(f"get_role_owner({role}) = {g.get_role_owner(role)}, scan gives {owner}")
+    return errors
+
+
+def new_game(rnd: random.Random) -> Game:
+    g = Game(game_id="index-check", host_id=0)
+    engine.init_default_roles(g)
+    players = rnd.randint(9, 14)
+    for i in range(players):
+        engine.add_player(g, f"Игрок {i + 1}")
+    roles = {
+        engine.ROLE_MAFIA: rnd.randint(1, 3), engine.ROLE_COMMISSIONER: 1, engine.ROLE_MONK: 1,
+        engine.ROLE_SEER: rnd.randint(0, 1), engine.ROLE_AVENGER: rnd.randint(0, 1),
+        engine.ROLE_BANSHEE: rnd.randint(0, 1), engine.ROLE_DUKE: rnd.randint(0, 1),
+        engine.ROLE_MANIAC: rnd.randint(0, 1), engine.ROLE_RAT: rnd.randint(0, 1),
+        engine.ROLE_IMMORTAL: rnd.randint(0, 1),
+    }
+    roles[engine.ROLE_CIVIL] = max(0, players - 3 - sum(roles.values()))
+    for role, count in roles.items():
+        try:
+            engine.set_role_count(g, role, count)
+        except GameError:
+            pass
+    return g
+
+
+def random_move(g: Game, rnd: random.Random, move: int):
+    """One move for the current stage; sometimes an undo or a player change instead"""
+    alive = g.alive_names()
+    r = rnd.random()
+    if r < 0.12:
+        return engine.undo(g)
+    if r < 0.14 and g.players:
+        return engine.remove_player(g, rnd.choice(list(g.players)))
+    if r < 0.16:
+        return engine.add_player(g, f"Гость {move}")
+    stage = g.stage
+    if stage in (Stage.LOBBY, Stage.ADD_PLAYERS, Stage.EDIT_ROLES, Stage.PRESTART):
+        # Players come and go in the lobby too: civilians make up the difference,
+        # and with too few players an optional role is dropped
+        missing = len(g.players) - engine.roles_sum(g)
+        civilians = g.role_counts.get(engine.ROLE_CIVIL, 0)
+        if missing > 0 or (missing < 0 and civilians):
+            return engine.set_role_count(g, engine.ROLE_CIVIL, max(0, civilians + missing))
+        if missing < 0:
+            optional = [role for role, count in g.role_counts.items()
+                        if (count and role in OPTIONAL_ROLES) or (role == engine.ROLE_MAFIA and count > 1)]
+            role = rnd.choice(optional)
+            return engine.set_role_count(g, role, g.role_counts[role] - 1)
+        return engine.start_game(g)
+    if stage == Stage.NIGHT0_BIND_ROLE:
+        remaining = [role for role, count in g.bind_remaining.items() if count > 0]
+        if remaining and rnd.random() < 0.9:
+            return engine.bind_role(g, rnd.choice(remaining))
+        return engine.bind_undo(g)
+    if stage == Stage.NIGHT0_BIND_PLAYER:
+        if g.bind_available_players:
+            return engine.bind_player(g, rnd.choice(g.bind_available_players))
+        return engine.set_stage(g, Stage.MAYOR_SELECT)
+    if not alive:
+        return engine.set_stage(g, Stage.END)
+    if stage == Stage.MAYOR_SELECT:
+        return engine.select_mayor(g, rnd.choice(alive))
+    if stage == Stage.SUCCESSOR_SELECT:
+        return engine.select_successor(g, rnd.choice(alive))
+    if stage == Stage.DAY_MENU:
+        return engine.skip_to_night(g) if g.skip_vote_day == g.day else engine.day_vote_start(g)
+    if stage == Stage.DAY_VOTE_PICK:
+        return engine.day_vote(g, rnd.choice(alive))
+    if stage == Stage.AVENGER_REVENGE_PICK:
+        return engine.avenger_revenge(g, rnd.choice(alive))
+    if stage == Stage.NIGHT_MENU:
+        if g.night_step_index >= len(g.night_steps):
+            return engine.finish_night(g)
+        step = g.night_steps[g.night_step_index]
+        if step in engine.YESNO_STEPS:
+            return engine.night_action(g, choice=rnd.random() < 0.6)
+        return engine.night_action(g, target=rnd.choice(engine.cached_step_targets(g, step) or alive))
+    return engine.set_stage(g, Stage.DAY_MENU)
+
+
+def check(games: int, moves: int, seed: int) -> int:
+    checks = failures = 0
+    for n in range(games):
+        rnd = random.Random(seed + n)
+        g = new_game(rnd)
+        for move in range(moves):
+            try:
+                random_move(g, rnd, move)
+            except GameError:
+                pass
+            for label, game in (("live", g), ("decoded", engine.game_from_json(engine.game_to_json(g)))):
+                errors = mismatches(game)
+                checks += 1
+                if errors:
+                    failures += 1
+                    print(f"  game {n}, move {move} ({g.stage}, {label}): " + "; ".join(errors))
+            if g.stage == Stage.END:
+                break
+    print(f"{games} games, {checks} checks, {failures} mismatches")
+    return failures
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--games", type=int, default=300)
+    parser.add_argument("--moves", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if check(args.games, args.moves, args.seed):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
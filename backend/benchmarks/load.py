@@ -0,0 +1,200 @@
+"""End-to-end load: full games at 1, 10, 100 and 1000 concurrent tables.
+
+Every game goes through the whole lifecycle like the frontend does (see
+common.play_game): create, add_player x N, set_role_count, start, the
+bind_role / bind_player loop, mayor and successor, then days and nights
+until END, refetching the state after every action. Each concurrency level
+reports p50 / p95 / p99 latency per endpoint and the total throughput, and
+the whole run is written as JSON for comparing builds.
+
+    python -m benchmarks.load [--levels 1,10,100,1000] [--games 100] [--out load_results.json]
+    python -m benchmarks.load --url http://127.0.0.1:8000   # against a running uvicorn
+
+In-process runs drive main.app through ASGI with the store selected by
+MAFIA_STORE, like the server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import subprocess
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from .common import AsgiClient, play_game
+
+GAME_PATH = re.compile(r"^/api/game/(?!create$)[^/]+")
+
+
+def endpoint_key(method: str, url: str) -> str:
+    """"POST /api/game/<id>/day_vote?x=1" -> "POST /api/game/{game_id}/day_vote\""""
+    path = urlsplit(url).path
+    return f"{method} {GAME_PATH.sub('/api/game/{game_id}', path)}"
+
+
+class TimedClient:
+    """Wraps a client and records the latency of every call per endpoint"""
+
+    def __init__(self, client):
+        self.client = client
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+
+    @property
+    def requests(self) -> int:
+        return sum(len(v) for v in self.latencies.values())
+
+    async def call(self, method: str, url: str, body: Optional[dict] = None) -> dict:
+        start = time.perf_counter()
+        try:
+            return await self.client.call(method, url, body)
+        finally:
+            self.latencies[endpoint_key(method, url)].append(time.perf_counter() - start)
+
+
+class HttpClient:
+    """Keep-alive HTTP/1.1 client on asyncio streams, for a server given by --url"""
+
+    def __init__(self, url: str, connections: int = 64):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 80
+        self.connections = connections
+        self._idle: list = []
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def call(self, method: str, url: str, body: Optional[dict] = None) -> dict:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.connections)
+        payload = json.dumps(body).encode() if body is not None else b""
+        head = (f"{method} {url} HTTP/1.1\r\nHost: {self.host}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n")
+        async with self._slots:
+            reader, writer = self._idle.pop() if self._idle else await asyncio.open_connection(self.host, self.port)
+            writer.write(head.encode() + payload)
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+            data = await reader.readexactly(length)
+            self._idle.append((reader, writer))
+        if status >= 400:
+            raise RuntimeError(f"{method} {url} -> {status}: {data.decode()}")
+        return json.loads(data) if data else {}
+
+    def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+        self._slots = None
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Linear interpolation between closest ranks; values must be sorted"""
+    if len(values) == 1:
+        return values[0]
+    pos = (len(values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def summarize(latencies: List[float]) -> dict:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p95_ms": percentile(values, 0.95) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "max_ms": values[-1] * 1000,
+    }
+
+
+async def run_level(client, concurrency: int, games: int, players: int, seed: int) -> dict:
+    timed = TimedClient(client)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with sem:
+            await play_game(timed, n_players=players, seed=seed + i, host_id=i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(games)))
+    elapsed = time.perf_counter() - start
+    if isinstance(client, HttpClient):
+        # Connections belong to the event loop of this level
+        client.close()
+    return {
+        "concurrency": concurrency,
+        "games": games,
+        "requests": timed.requests,
+        "seconds": elapsed,
+        "requests_per_s": timed.requests / elapsed,
+        "games_per_s": games / elapsed,
+        "all": summarize([v for values in timed.latencies.values() for v in values]),
+        "endpoints": {key: summarize(values) for key, values in sorted(timed.latencies.items())},
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_level(level: dict):
+    print(f"\n{level['concurrency']} concurrent games: {level['games']} games, {level['requests']} requests, "
+          f"{level['seconds']:.1f}s, {level['requests_per_s']:.0f} req/s, {level['games_per_s']:.1f} games/s")
+    print(f"  {'endpoint':<48} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for key, s in [*level["endpoints"].items(), ("all", level["all"])]:
+        print(f"  {key:<48} {s['count']:>7} {s['p50_ms']:>8.2f} {s['p95_ms']:>8.2f} {s['p99_ms']:>8.2f}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", default="1,10,100,1000", help="comma-separated concurrent game counts")
+    parser.add_argument("--games", type=int, default=100, help="games per level (at least the level itself)")
+    parser.add_argument("--players", type=int, default=10)
+    parser.add_argument("--url", help="benchmark a running server instead of main.app in-process")
+    parser.add_argument("--out", default="load_results.json", help="JSON results file")
+    args = parser.parse_args()
+
+    if args.url:
+        client = HttpClient(args.url)
+        target = args.url
+    else:
+        import main
+        client = AsgiClient(main.app)
+        target = f"in-process ({type(main.STORE).__name__})"
+
+    results = {
+        "target": target,
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "players": args.players,
+        "levels": [],
+    }
+    print(f"target: {target}")
+    for n, concurrency in enumerate(map(int, args.levels.split(","))):
+        level = asyncio.run(run_level(client, concurrency, max(args.games, concurrency), args.players, n * 100_000))
+        results["levels"].append(level)
+        print_level(level)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nresults written to {args.out}")
+
+
+if __name__ == "__main__":
+    main_cli()
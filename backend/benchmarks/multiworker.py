@@ -0,0 +1,126 @@
+"""Full games against several worker processes sharing one SQLite file.
+
+Starts N separate uvicorn processes (MAFIA_STORE=shared, same MAFIA_DB_PATH)
+and sends consecutive requests of every game to different workers in turn,
+so each game is played across all of them. Reports req/s for 1..N workers.
+
+    python -m benchmarks.multiworker [--workers 4] [--games 100] [--concurrency 16]
+"""
+import argparse
+import asyncio
+import http.client
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import List, Optional
+
+from .common import play_game
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class RoundRobinClient:
+    """Blocking keep-alive HTTP client; each request goes to the next worker"""
+
+    def __init__(self, ports: List[int]):
+        self.ports = ports
+        self._next = itertools.count()
+        self._local = threading.local()
+        self.requests = 0
+
+    def _conn(self, port: int) -> http.client.HTTPConnection:
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        if port not in conns:
+            conns[port] = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        return conns[port]
+
+    def _call(self, method: str, url: str, body: Optional[dict]) -> dict:
+        port = self.ports[next(self._next) % len(self.ports)]
+        conn = self._conn(port)
+        payload = json.dumps(body) if body is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        conn.request(method, url, body=payload, headers=headers)
+        resp = conn.getresponse()
+        data = resp.read()
+        self.requests += 1
+        if resp.status >= 400:
+            raise RuntimeError(f"{method} {url} -> {resp.status} (port {port}): {data.decode()}")
+        return json.loads(data) if data else {}
+
+    async def call(self, method: str, url: str, body: Optional[dict] = None) -> dict:
+        return await asyncio.to_thread(self._call, method, url, body)
+
+
+def start_workers(n: int, db_path: str, base_port: int) -> List[subprocess.Popen]:
+    env = dict(os.environ, MAFIA_STORE="shared", MAFIA_DB_PATH=db_path)
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(base_port + i),
+             "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env,
+        )
+        for i in range(n)
+    ]
+    for i in range(n):
+        deadline = time.time() + 20
+        while True:
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", base_port + i, timeout=1)
+                conn.request("GET", "/api/roles")
+                conn.getresponse().read()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise RuntimeError(f"worker on port {base_port + i} did not start")
+                time.sleep(0.1)
+    return procs
+
+
+async def run_games(client: RoundRobinClient, games: int, concurrency: int):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with sem:
+            game_id = await play_game(client, seed=i)
+            # Every worker must see the same final state
+            states = [await client.call("GET", f"/api/game/{game_id}") for _ in client.ports]
+            if any(s != states[0] for s in states) or states[0]["stage"] != "END":
+                raise RuntimeError(f"workers disagree on game {game_id}")
+
+    await asyncio.gather(*(one(i) for i in range(games)))
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--port", type=int, default=18100)
+    args = parser.parse_args()
+
+    for n in range(1, args.workers + 1):
+        with tempfile.TemporaryDirectory() as tmp:
+            procs = start_workers(n, os.path.join(tmp, "shared.db"), args.port)
+            try:
+                client = RoundRobinClient([args.port + i for i in range(n)])
+                start = time.perf_counter()
+                asyncio.run(run_games(client, args.games, args.concurrency))
+                elapsed = time.perf_counter() - start
+            finally:
+                for p in procs:
+                    p.terminate()
+                for p in procs:
+                    p.wait()
+        print(f"{n} worker(s): {client.requests:>6} requests  {elapsed:6.2f}s  "
+              f"{client.requests / elapsed:7.0f} req/s  (all games reached END consistently)")
+
+
+if __name__ == "__main__":
+    main_cli()
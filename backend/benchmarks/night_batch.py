@@ -0,0 +1,91 @@
+"""Nights per second: NumPy batch resolver vs engine.apply_night_and_get_deaths.
+
+Generates random nights (random compositions, dead players, choices that
+may be missing or point at dead players), first checks that the batch
+resolver returns exactly the deaths of the scalar function on --check of
+them (also through encode_games), then times both.
+
+    python -m benchmarks.night_batch [--nights 1000000] [--players 12] [--check 20000]
+
+Needs NumPy.
+"""
+import argparse
+import time
+
+import numpy as np
+
+import engine
+from engine import Game, NightChoices, Player
+from night_batch import CHOICES, ROLE_CODES, NightBatch, decode_deaths, encode_games, resolve_nights
+
+# Roles that change who dies at night are over-represented; a second courtesan
+# checks that the first one in player order is the one whose client dies
+ROLE_POOL = [engine.ROLE_IMMORTAL, engine.ROLE_MANIAC, engine.ROLE_MONK, engine.ROLE_AVENGER,
+             engine.ROLE_COMMISSIONER, engine.ROLE_SEER, engine.ROLE_RAT, engine.ROLE_RAT_MAFIA,
+             engine.ROLE_COURTESAN]
+
+
+def random_batch(n: int, players: int, rng: np.random.Generator) -> NightBatch:
+    base = [engine.ROLE_BOSS, engine.ROLE_DOCTOR, engine.ROLE_COURTESAN, engine.ROLE_MAFIA]
+    roles = np.empty((n, players), dtype=np.int8)
+    for i in range(n):
+        extra = list(rng.choice(ROLE_POOL, size=rng.integers(0, len(ROLE_POOL) + 1), replace=False))
+        deck = (base + extra + [engine.ROLE_CIVIL] * players)[:players]
+        roles[i] = rng.permutation([ROLE_CODES.index(r) for r in deck])
+    alive = rng.random((n, players)) < 0.75
+    choices = {name: rng.integers(-1, players, size=n, dtype=np.int32) for name in CHOICES}
+    return NightBatch(alive=alive, roles=roles, **choices)
+
+
+def to_games(b: NightBatch, count: int) -> list:
+    games = []
+    for i in range(count):
+        names = [f"Игрок {j + 1}" for j in range(b.alive.shape[1])]
+        g = Game(game_id=str(i), host_id=0, players={
+            name: Player(name=name, role=ROLE_CODES[b.roles[i, j]], alive=bool(b.alive[i, j]))
+            for j, name in enumerate(names)
+        })
+        g.night_choices = NightChoices(**{
+            name: names[getattr(b, name)[i]] if getattr(b, name)[i] >= 0 else None for name in CHOICES
+        })
+        games.append(g)
+    return games
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nights", type=int, default=1_000_000)
+    parser.add_argument("--players", type=int, default=12)
+    parser.add_argument("--check", type=int, default=20000, help="nights compared against the scalar function")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    check = min(args.check, args.nights)
+    batch = random_batch(args.nights, args.players, rng)
+
+    games = to_games(batch, check)
+    start = time.perf_counter()
+    expected = [engine.apply_night_and_get_deaths(g)[0] for g in games]
+    scalar_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    deaths = resolve_nights(batch)
+    batch_time = time.perf_counter() - start
+
+    names = [list(g.players) for g in games]
+    mismatches = sum(a != b for a, b in zip(decode_deaths(deaths[:check], names), expected))
+    encoded, encoded_names = encode_games(games)
+    mismatches += sum(a != b for a, b in zip(decode_deaths(resolve_nights(encoded), encoded_names), expected))
+    if mismatches:
+        raise SystemExit(f"batch resolver disagrees with apply_night_and_get_deaths on {mismatches} nights")
+    print(f"checked {check} nights against the scalar function: identical "
+          f"({sum(map(len, expected))} deaths)")
+
+    print(f"{'resolver':<8} {'nights':>9} {'seconds':>8} {'nights/s':>12}")
+    print(f"{'scalar':<8} {check:>9} {scalar_time:>8.2f} {check / scalar_time:>12,.0f}")
+    print(f"{'numpy':<8} {args.nights:>9} {batch_time:>8.2f} {args.nights / batch_time:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main_cli()
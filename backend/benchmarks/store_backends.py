@@ -0,0 +1,55 @@
+"""Requests per second with MemoryGameStore vs SqliteGameStore.
+
+    python -m benchmarks.store_backends [--games 200] [--concurrency 20]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import main
+from store import MemoryGameStore, SqliteGameStore
+
+from .common import AsgiClient, play_game
+
+
+async def run_games(games: int, concurrency: int) -> int:
+    client = AsgiClient(main.app)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with sem:
+            await play_game(client, seed=i)
+
+    await asyncio.gather(*(one(i) for i in range(games)))
+    return client.requests
+
+
+def bench(name: str, store, games: int, concurrency: int):
+    main.STORE = store
+    try:
+        start = time.perf_counter()
+        requests = asyncio.run(run_games(games, concurrency))
+        elapsed = time.perf_counter() - start
+    finally:
+        store.close()
+    print(f"{name:<8} {requests:>7} requests  {elapsed:6.2f}s  {requests / elapsed:8.0f} req/s")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    bench("memory", MemoryGameStore(), args.games, args.concurrency)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        bench("sqlite", SqliteGameStore(path, encode=main.game_to_json, decode=main.game_from_json,
+                                        history=main.GameHistory()),
+              args.games, args.concurrency)
+
+
+if __name__ == "__main__":
+    main_cli()
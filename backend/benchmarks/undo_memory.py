@@ -0,0 +1,122 @@
+"""Undo stack memory and push_undo cost over a 30-night game.
+
+Plays a 64-player game where nobody dies at night and one civilian is
+voted out each day, so the log keeps growing. For every night prints the
+bytes held only by the undo stack and the average push_undo time, next to
+what full-copy snapshots (players + protected + night_steps + whole log per
+entry) would have cost.
+
+    python -m benchmarks.undo_memory [--nights 30]
+"""
+import argparse
+import sys
+import time
+
+import engine
+import main
+from main import (
+    AddPlayerRequest, BindPlayerRequest, BindRoleRequest, CreateGameRequest, NightActionRequest,
+    SelectMayorRequest, SelectSuccessorRequest, SetRoleCountRequest, VoteRequest,
+)
+
+
+def deep_size(obj, seen: set) -> int:
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(deep_size(v, seen) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_size(vars(obj), seen)
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_size(getattr(obj, name), seen) for name in obj.__slots__ if hasattr(obj, name))
+    return size
+
+
+def undo_only_bytes(g: engine.Game) -> int:
+    """Bytes reachable from undo_stack but not from the rest of the game"""
+    stack = g.undo_stack
+    g.undo_stack = []
+    live: set = set()
+    deep_size(g, live)
+    g.undo_stack = stack
+    return deep_size(stack, live)
+
+
+def full_copy_bytes(g: engine.Game) -> int:
+    """Approximate cost of one full-copy snapshot of the same game"""
+    snap = (
+        {n: {"name": p.name, "role": p.role, "alive": p.alive, "is_mayor": p.is_mayor,
+             "is_successor": p.is_successor} for n, p in g.players.items()},
+        dict(g.protected_from_vote_day),
+        g.night_steps[:],
+        g.log_lines[:],
+    )
+    return deep_size(snap, {id(s) for s in g.log_lines} | set(map(id, g.players)))
+
+
+def setup_game(players: int) -> engine.Game:
+    game_id = main.create_game(req=CreateGameRequest(host_id=1))["game_id"]
+    names = [f"Игрок {i + 1}" for i in range(players)]
+    for name in names:
+        main.add_player(game_id=game_id, req=AddPlayerRequest(player_name=name))
+    for role, count in {"Мафия": 10, "Комиссар": 1, "Монах": 1, "Гадалка": 1,
+                        "Мирный житель": players - 16}.items():
+        main.set_role_count(game_id=game_id, req=SetRoleCountRequest(role=role, count=count))
+    main.start_game(game_id=game_id)
+    g = main.get_game(game_id)
+    for role, count in list(g.bind_remaining.items()):
+        for _ in range(count):
+            main.bind_role(game_id=game_id, req=BindRoleRequest(role=role))
+            main.bind_player(game_id=game_id, req=BindPlayerRequest(player_name=g.bind_available_players[0]))
+    main.select_mayor(game_id=game_id, req=SelectMayorRequest(player_name=names[0]))
+    main.select_successor(game_id=game_id, req=SelectSuccessorRequest(player_name=names[1]))
+    return g
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nights", type=int, default=30)
+    parser.add_argument("--players", type=int, default=64)
+    args = parser.parse_args()
+
+    g = setup_game(args.players)
+    game_id = g.game_id
+    print(f"{'night':>5} {'log':>5} {'entries':>7} {'undo bytes':>10} {'full-copy bytes':>15} {'push µs':>8}")
+    for night in range(1, args.nights + 1):
+        civil = next(p.name for p in g.players.values() if p.alive and p.role == engine.ROLE_CIVIL
+                     and g.protected_from_vote_day.get(p.name) != g.day)
+        main.day_vote_start(game_id=game_id)
+        main.day_vote(game_id=game_id, req=VoteRequest(target=civil))
+
+        push_time = 0.0
+        pushes = 0
+        victim = None
+        while g.night_step_index < len(g.night_steps):
+            step = g.night_steps[g.night_step_index]
+            targets = engine.get_step_targets(g, step)
+            if step == "mafia_kill":
+                # A different civilian every night so the doctor may heal them
+                victim = next(n for n in targets if g.players[n].role == engine.ROLE_CIVIL and n != g.last_doctor)
+                target = victim
+            elif step == "doctor_heal":
+                target = victim
+            else:
+                target = next(n for n in targets if n != victim)
+            start = time.perf_counter()
+            g.push_undo()
+            push_time += time.perf_counter() - start
+            pushes += 1
+            g.pop_undo()
+            main.night_action(game_id=game_id, req=NightActionRequest(target=target, choice=False))
+
+        print(f"{night:>5} {len(g.log_lines):>5} {len(g.undo_stack):>7} {undo_only_bytes(g):>10} "
+              f"{full_copy_bytes(g) * len(g.undo_stack):>15} {push_time / pushes * 1e6:>8.2f}")
+        main.finish_night(game_id=game_id)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,92 @@
+"""WebSocket fan-out: one game watched by many viewers.
+
+Connects N viewers to /ws/game/{id}, then the moderator issues mutations
+over its own socket. For every mutation measures the time until every
+viewer has received the state with the new version, and the moderator's
+command round trip.
+
+    python -m benchmarks.ws_fanout [--viewers 500] [--mutations 50]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import main
+
+from .common import AsgiClient, AsgiWebSocket
+
+
+def pct(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(viewers: int, mutations: int):
+    client = AsgiClient(main.app)
+    game_id = (await client.call("POST", "/api/game/create", {"host_id": 1}))["game_id"]
+    path = f"/ws/game/{game_id}"
+
+    seen = {}
+    reached = {}
+
+    async def viewer(ws: AsgiWebSocket):
+        while True:
+            msg = await ws.receive_json()
+            if msg["type"] != "state":
+                continue
+            version = msg["state"]["version"]
+            for v in [v for v in reached if v <= version and ws not in seen[v]]:
+                seen[v].add(ws)
+                if len(seen[v]) == viewers:
+                    reached[v].set()
+
+    sockets = [AsgiWebSocket(main.app, path) for _ in range(viewers)]
+    for ws in sockets:
+        assert await ws.connect()
+    for ws in sockets:
+        await ws.receive_json()  # initial state
+    tasks = [asyncio.create_task(viewer(ws)) for ws in sockets]
+
+    moderator = AsgiWebSocket(main.app, path)
+    assert await moderator.connect()
+    await moderator.receive_json()
+
+    fanout, round_trip = [], []
+    version = main.get_game(game_id).version
+    for i in range(mutations):
+        version += 1
+        seen[version] = set()
+        reached[version] = asyncio.Event()
+        start = time.perf_counter()
+        await moderator.send_json({"id": i, "command": "add_player", "args": {"player_name": f"Игрок {i}"}})
+        while (await moderator.receive_json())["type"] != "result":
+            pass
+        round_trip.append(time.perf_counter() - start)
+        await reached[version].wait()
+        fanout.append(time.perf_counter() - start)
+
+    for t in tasks:
+        t.cancel()
+    for ws in sockets + [moderator]:
+        await ws.close()
+
+    total = sum(fanout)
+    print(f"viewers: {viewers}, mutations: {mutations}")
+    print(f"command round trip  p50 {statistics.median(round_trip) * 1e3:7.2f} ms   "
+          f"p99 {pct(round_trip, 0.99) * 1e3:7.2f} ms")
+    print(f"fan-out to all      p50 {statistics.median(fanout) * 1e3:7.2f} ms   "
+          f"p99 {pct(fanout, 0.99) * 1e3:7.2f} ms")
+    print(f"delivered           {viewers * mutations / total:,.0f} state messages/s")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--viewers", type=int, default=500)
+    parser.add_argument("--mutations", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.viewers, args.mutations))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,72 @@
+"""Check: WebSocket clients see changes made through another worker.
+
+Starts two uvicorn processes on one shared SQLite file (MAFIA_STORE=shared),
+watches a game over a WebSocket on the first and changes it over HTTP on the
+second. Every change must reach the socket; reports how long it took, which
+is bounded by MAFIA_WS_POLL.
+
+    python -m benchmarks.ws_workers [--mutations 20] [--poll 0.5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import websockets
+
+from .multiworker import RoundRobinClient, start_workers
+
+
+async def run(port: int, mutations: int, timeout: float) -> int:
+    other = RoundRobinClient([port + 1])
+    game_id = (await other.call("POST", "/api/game/create", {"host_id": 1}))["game_id"]
+    delays = []
+    missed = 0
+    async with websockets.connect(f"ws://127.0.0.1:{port}/ws/game/{game_id}") as ws:
+        version = json.loads(await ws.recv())["state"]["version"]
+        for i in range(mutations):
+            start = time.perf_counter()
+            await other.call("POST", f"/api/game/{game_id}/add_player", {"player_name": f"Игрок {i + 1}"})
+            expected = (await other.call("GET", f"/api/game/{game_id}"))["version"]
+            try:
+                while version < expected:
+                    message = json.loads(await asyncio.wait_for(ws.recv(), timeout))
+                    if message["type"] == "state":
+                        version = message["state"]["version"]
+                delays.append(time.perf_counter() - start)
+            except asyncio.TimeoutError:
+                missed += 1
+                print(f"  change {i + 1} (version {expected}) did not reach the socket in {timeout:.1f}s")
+    if delays:
+        print(f"{len(delays)} of {mutations} changes pushed, delay median {statistics.median(delays) * 1000:.0f} ms, "
+              f"max {max(delays) * 1000:.0f} ms")
+    return missed
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mutations", type=int, default=20)
+    parser.add_argument("--poll", type=float, default=0.5)
+    parser.add_argument("--port", type=int, default=18200)
+    args = parser.parse_args()
+
+    os.environ["MAFIA_WS_POLL"] = str(args.poll)
+    with tempfile.TemporaryDirectory() as tmp:
+        procs = start_workers(2, os.path.join(tmp, "shared.db"), args.port)
+        try:
+            missed = asyncio.run(run(args.port, args.mutations, timeout=args.poll * 4 + 1))
+        finally:
+            for p in procs:
+                p.terminate()
+            for p in procs:
+                p.wait()
+    if missed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
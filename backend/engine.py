@@ -0,0 +1,1711 @@
+"""Game rules without HTTP.
+
+Roles, the Game model and the whole moderator flow live here. Every action
+takes a Game and its arguments, changes the game in place and returns the
+response of the matching endpoint; a move the rules do not allow raises
+GameError. main.py loads and stores games and turns GameError into an HTTP
+error, simulate.py plays games with the same functions directly.
+
+Every accepted action is recorded on the game as an Event, and the state is
+snapshotted every SNAPSHOT_EVERY events, so rebuild() can recreate the game
+as of any event by replaying from the nearest snapshot. The history is not
+part of the game state (game_to_json): the SQLite stores append it to tables
+of its own, one small row per action.
+"""
+import base64
+import bisect
+import copy
+import functools
+import inspect
+import json
+import sys
+import zlib
+from array import array
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields, asdict
+from enum import Enum
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+
+class GameError(Exception):
+    """Move not allowed by the rules; detail is shown to the moderator"""
+
+    def __init__(self, detail: str, status_code: int = 400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+# ==========================
+# ROLES
+# ==========================
+ROLE_BOSS = "Босс мафии"
+ROLE_MAFIA = "Мафия"
+ROLE_DOCTOR = "Доктор"
+ROLE_COURTESAN = "Куртизанка"
+ROLE_MANIAC = "Маньяк"
+ROLE_IMMORTAL = "Бессмертный"
+ROLE_AVENGER = "Мститель"
+ROLE_CIVIL = "Мирный житель"
+ROLE_COMMISSIONER = "Комиссар"
+ROLE_DUKE = "Герцог"
+ROLE_BANSHEE = "Банши"
+ROLE_MONK = "Монах"
+ROLE_SEER = "Гадалка"
+ROLE_RAT = "Крыса"
+ROLE_RAT_MAFIA = "мафия(крыса)"
+
+ALL_ROLES_ORDER = [
+    ROLE_BOSS, ROLE_DOCTOR, ROLE_COURTESAN, ROLE_MAFIA,
+    ROLE_AVENGER, ROLE_IMMORTAL, ROLE_RAT, ROLE_COMMISSIONER,
+    ROLE_DUKE, ROLE_BANSHEE, ROLE_MANIAC, ROLE_MONK,
+    ROLE_SEER, ROLE_CIVIL,
+]
+
+BIND_ROLES_ORDER = [
+    ROLE_BOSS, ROLE_MAFIA, ROLE_DOCTOR, ROLE_COURTESAN,
+    ROLE_AVENGER, ROLE_IMMORTAL, ROLE_RAT, ROLE_COMMISSIONER,
+    ROLE_DUKE, ROLE_BANSHEE, ROLE_MANIAC, ROLE_MONK,
+    ROLE_SEER, ROLE_CIVIL,
+]
+
+ROLE_SHORT = {
+    ROLE_BOSS: "Босс",
+    ROLE_DOCTOR: "Доктор",
+    ROLE_COURTESAN: "Куртиз",
+    ROLE_MAFIA: "Мафия",
+    ROLE_AVENGER: "Мститель",
+    ROLE_IMMORTAL: "Бессмерт",
+    ROLE_RAT: "Крыса",
+    ROLE_COMMISSIONER: "Комисс",
+    ROLE_DUKE: "Герцог",
+    ROLE_BANSHEE: "Банши",
+    ROLE_MANIAC: "Маньяк",
+    ROLE_MONK: "Монах",
+    ROLE_SEER: "Гадал",
+    ROLE_CIVIL: "Мирный",
+    ROLE_RAT_MAFIA: "Мафия(Крыса)",
+}
+
+# Role descriptions for UI
+ROLE_DESCRIPTIONS = {
+    ROLE_BOSS: "Глава мафии. Может запугать игрока (защита от голосования на день).",
+    ROLE_MAFIA: "Член мафии. Убивает ночью вместе с боссом.",
+    ROLE_DOCTOR: "Лечит одного игрока за ночь. Не может лечить одного дважды подряд.",
+    ROLE_COURTESAN: "Защищает клиента ночью. Если её убьют — клиент тоже умрёт.",
+    ROLE_MANIAC: "Нейтрал. Убивает ночью. Побеждает если остаётся последним.",
+    ROLE_IMMORTAL: "Не может умереть ночью.",
+    ROLE_AVENGER: "При смерти днём может забрать кого-то с собой.",
+    ROLE_CIVIL: "Обычный мирный житель.",
+    ROLE_COMMISSIONER: "Проверяет игроков на принадлежность к мафии.",
+    ROLE_DUKE: "При смерти ночью — следующий день без голосования (траур).",
+    ROLE_BANSHEE: "При смерти днём — ночь не наступает.",
+    ROLE_MONK: "Перенаправляет убийство с одного игрока на другого.",
+    ROLE_SEER: "Выбирает игрока для гадания (таро в реале).",
+    ROLE_RAT: "Может стать мафией если обе стороны согласны.",
+    ROLE_RAT_MAFIA: "Бывшая крыса, ставшая мафией.",
+}
+
+
+def is_mafia_role(role: Optional[str]) -> bool:
+    return role in {ROLE_BOSS, ROLE_MAFIA, ROLE_RAT_MAFIA}
+
+
+def is_peace_role(role: Optional[str]) -> bool:
+    return role is not None and (not is_mafia_role(role)) and role != ROLE_MANIAC
+
+
+# ==========================
+# STAGES
+# ==========================
+class Stage(str, Enum):
+    LOBBY = "LOBBY"
+    ADD_PLAYERS = "ADD_PLAYERS"
+    EDIT_ROLES = "EDIT_ROLES"
+    PRESTART = "PRESTART"
+    EDIT_PARTICIPANTS = "EDIT_PARTICIPANTS"
+    REMOVE_PLAYER = "REMOVE_PLAYER"
+
+    NIGHT0_BIND_ROLE = "NIGHT0_BIND_ROLE"
+    NIGHT0_BIND_PLAYER = "NIGHT0_BIND_PLAYER"
+
+    MAYOR_SELECT = "MAYOR_SELECT"
+    SUCCESSOR_SELECT = "SUCCESSOR_SELECT"
+
+    DAY_MENU = "DAY_MENU"
+    DAY_VOTE_PICK = "DAY_VOTE_PICK"
+    AVENGER_REVENGE_PICK = "AVENGER_REVENGE_PICK"
+
+    NIGHT_MENU = "NIGHT_MENU"
+    NIGHT_PICK = "NIGHT_PICK"
+
+    END = "END"
+
+
+# ==========================
+# MODELS
+# ==========================
+def slotted(cls):
+    """Rebuild a dataclass with __slots__ (dataclass(slots=True) needs Python 3.10).
+
+    Attributes the class sets outside its fields are listed in its own __slots__.
+    """
+    own = tuple(cls.__dict__.get("__slots__", ()))
+    names = tuple(f.name for f in fields(cls)) + own
+    ns = {k: v for k, v in cls.__dict__.items() if k not in names and k not in ("__dict__", "__weakref__")}
+    ns["__slots__"] = names
+    new_cls = type(cls)(cls.__name__, cls.__bases__, ns)
+    new_cls.__qualname__ = cls.__qualname__
+    return new_cls
+
+
+def interned(value):
+    """Share one string object per player name / role across all game structures"""
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, (list, tuple)):
+        return type(value)(interned(v) for v in value)
+    if isinstance(value, dict):
+        return {interned(k): interned(v) for k, v in value.items()}
+    return value
+
+
+@slotted
+@dataclass
+class Player:
+    name: str
+    role: Optional[str] = None
+    alive: bool = True
+    is_mayor: bool = False
+    is_successor: bool = False
+
+
+@slotted
+@dataclass
+class NightChoices:
+    mafia_target: Optional[str] = None
+    boss_intimidate: Optional[str] = None
+    maniac_target: Optional[str] = None
+    commissioner_target: Optional[str] = None
+    monk_first: Optional[str] = None
+    monk_second: Optional[str] = None
+    doctor_target: Optional[str] = None
+    courtesan_client: Optional[str] = None
+    seer_target: Optional[str] = None
+    rat_wants: Optional[bool] = None
+    mafia_wants_rat: Optional[bool] = None
+
+
+@slotted
+@dataclass
+class UndoEntry:
+    """Undo checkpoint.
+
+    Scalar fields are captured at push time. Changes to players and
+    protected_from_vote_day made afterwards are journaled as
+    (kind, ...) tuples holding the old values, and the log is restored
+    by truncating it to log_len, so an entry costs O(changed fields).
+    """
+    stage: Stage
+    day: int
+    night: int
+    mayor_name: Optional[str]
+    successor_name: Optional[str]
+    skip_vote_day: Optional[int]
+    intimidated_today: Optional[str]
+    night_choices: tuple  # NightChoices values in field order
+    night_steps: List[str]
+    night_step_index: int
+    pending_step: Optional[str]
+    last_boss_intimidate: Optional[str]
+    last_doctor: Optional[str]
+    last_courtesan: Optional[str]
+    last_seer: Optional[str]
+    last_monk_first: Optional[str]
+    last_commissioner: Optional[str]
+    avenger_pending: Optional[str]
+    log_len: int
+    changes: List[tuple] = field(default_factory=list)
+
+
+@slotted
+@dataclass
+class Event:
+    """Accepted action: name of the engine function and its arguments after the game.
+
+    args follow the parameter order of the function; a "batch" event holds its Events.
+    """
+    command: str
+    args: tuple
+
+
+def event_to_list(event: Event) -> list:
+    if event.command == "batch":
+        return [event.command, [event_to_list(inner) for inner in event.args]]
+    return [event.command, list(event.args)]
+
+
+def event_from_list(item: list) -> Event:
+    command, args = item
+    if command == "batch":
+        return Event(command, tuple(event_from_list(inner) for inner in args))
+    return Event(command, tuple(interned(args)))
+
+
+def event_from_dict(d: dict) -> Event:
+    # Games saved with the history inside their row hold events as dicts
+    if d["command"] == "batch":
+        return Event("batch", tuple(event_from_dict(inner) for inner in d["args"]))
+    return Event(d["command"], tuple(interned(d["args"])))
+
+
+class EventLog:
+    """Append-only list of Events, held as their JSON in one buffer.
+
+    An event costs its encoded size (a few dozen bytes) and an offset rather
+    than an Event object with its args tuple. Events are decoded when read,
+    which only replays do; encoded() gives the rows the SQLite stores append.
+    """
+    __slots__ = ("_data", "_ends")
+
+    # One encoder for all logs: json.dumps with options builds a new one per call
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def __init__(self, encoded: Iterable[bytes] = ()):
+        self._data = bytearray()
+        self._ends = array("I")  # offset in _data where each event ends
+        for data in encoded:
+            self.append_encoded(data)
+
+    def append(self, event: Event):
+        self.append_encoded(self._encoder.encode(event_to_list(event)).encode())
+
+    def append_encoded(self, data: bytes):
+        self._data += data
+        self._ends.append(len(self._data))
+
+    def encoded(self, start: int = 0, stop: Optional[int] = None) -> List[bytes]:
+        ends = self._ends[start:stop]
+        begin = self._ends[start - 1] if start else 0
+        rows = []
+        for end in ends:
+            rows.append(bytes(self._data[begin:end]))
+            begin = end
+        return rows
+
+    def __len__(self) -> int:
+        return len(self._ends)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            events = [event_from_list(json.loads(data)) for data in self.encoded(start, max(start, stop))]
+            return events[::step]
+        if index < 0:
+            index += len(self)
+        return event_from_list(json.loads(self.encoded(index, index + 1)[0]))
+
+    def __iter__(self) -> Iterator[Event]:
+        return iter(self[:])
+
+
+# Game state is snapshotted every SNAPSHOT_EVERY events (and before the first one)
+SNAPSHOT_EVERY = 100
+
+# A snapshot is the zlib-compressed state_json; a few hundred bytes for a 10 player game
+SNAPSHOT_LEVEL = 6
+
+
+@slotted
+@dataclass
+class Game:
+    __slots__ = ("_alive_total", "_alive_mafia", "_alive_peace", "_alive_owners",
+                 "step_targets_cache", "undo_batched", "batch_events", "history", "encoded_state",
+                 "events", "snapshots")
+
+    game_id: str
+    host_id: int
+
+    # bumped by every mutating endpoint
+    version: int = 0
+
+    stage: Stage = Stage.LOBBY
+    players: Dict[str, Player] = field(default_factory=dict)
+    role_counts: Dict[str, int] = field(default_factory=dict)
+
+    day: int = 0
+    night: int = 0
+
+    # night0 bind
+    bind_remaining: Dict[str, int] = field(default_factory=dict)
+    bind_available_players: List[str] = field(default_factory=list)
+    bind_stack: List[Tuple[str, str]] = field(default_factory=list)
+    bind_selected_role: Optional[str] = None
+
+    # mayor / successor
+    mayor_name: Optional[str] = None
+    successor_name: Optional[str] = None
+    protected_from_vote_day: Dict[str, int] = field(default_factory=dict)
+
+    # duke mourning
+    skip_vote_day: Optional[int] = None
+
+    # boss intimidation (player can't speak/vote today)
+    intimidated_today: Optional[str] = None
+
+    # undo
+    undo_stack: List[UndoEntry] = field(default_factory=list)
+
+    # night flow
+    night_choices: NightChoices = field(default_factory=NightChoices)
+    night_steps: List[str] = field(default_factory=list)
+    night_step_index: int = 0
+    pending_step: Optional[str] = None
+
+    # last targets restrictions
+    last_boss_intimidate: Optional[str] = None
+    last_doctor: Optional[str] = None
+    last_courtesan: Optional[str] = None
+    last_seer: Optional[str] = None
+    last_monk_first: Optional[str] = None
+    last_commissioner: Optional[str] = None
+
+    # avenger
+    avenger_pending: Optional[str] = None
+
+    # log; log_seqs[i] is the sequence number of log_lines[i], never reused
+    log_lines: List[str] = field(default_factory=list)
+    log_seqs: List[int] = field(default_factory=list)
+    log_next_seq: int = 1
+
+    def __post_init__(self):
+        # Derived index over alive players, kept up to date by the player methods
+        # below and by pop_undo; not part of the dataclass fields, so not serialized.
+        self._alive_total = 0
+        self._alive_mafia = 0
+        self._alive_peace = 0
+        self._alive_owners: Dict[str, Dict[str, None]] = {}  # role -> alive owners (ordered set)
+        for p in self.players.values():
+            self._index_player(p, 1)
+        # night step -> targets, filled by begin_night_internal / cached_step_targets
+        self.step_targets_cache: Dict[str, List[str]] = {}
+        # batch commands share one undo checkpoint: push_undo only starts a new stack
+        self.undo_batched = False
+        # events of the running batch, recorded together as one "batch" event
+        self.batch_events: Optional[List[Event]] = None
+        # record events and snapshots; the simulator turns it off
+        self.history = True
+        # history, outside the dataclass fields: append-only events and (event count, compressed state) snapshots
+        self.events = EventLog()
+        self.snapshots: List[Tuple[int, bytes]] = []
+        # (version, {slim: JSON bytes}) of the state last served, see main.encoded_game_state
+        self.encoded_state: Optional[Tuple[int, Dict[bool, bytes]]] = None
+
+    def invalidate_step_targets(self, *steps: str):
+        """Drop cached targets of the given steps, or of all steps"""
+        if not steps:
+            self.step_targets_cache.clear()
+        for step in steps:
+            self.step_targets_cache.pop(step, None)
+
+    def _index_player(self, p: Player, sign: int):
+        if not p.alive:
+            return
+        self._alive_total += sign
+        if is_mafia_role(p.role):
+            self._alive_mafia += sign
+        elif is_peace_role(p.role):
+            self._alive_peace += sign
+        if p.role is None:
+            return
+        if sign > 0:
+            self._alive_owners.setdefault(p.role, {})[p.name] = None
+        else:
+            owners = self._alive_owners[p.role]
+            del owners[p.name]
+            if not owners:
+                del self._alive_owners[p.role]
+
+    def alive_names(self) -> List[str]:
+        return [n for n, p in self.players.items() if p.alive]
+
+    def mafia_alive_names(self) -> List[str]:
+        return [p.name for p in self.players.values() if p.alive and is_mafia_role(p.role)]
+
+    def peace_alive_names(self) -> List[str]:
+        return [p.name for p in self.players.values() if p.alive and is_peace_role(p.role)]
+
+    def alive_count(self) -> int:
+        return self._alive_total
+
+    def mafia_alive_count(self) -> int:
+        return self._alive_mafia
+
+    def peace_alive_count(self) -> int:
+        return self._alive_peace
+
+    def maniac_alive(self) -> bool:
+        return ROLE_MANIAC in self._alive_owners
+
+    def role_alive_exists(self, role: str) -> bool:
+        return role in self._alive_owners
+
+    def get_role_owner(self, role: str) -> Optional[str]:
+        owners = self._alive_owners.get(role)
+        if not owners:
+            return None
+        if len(owners) == 1:
+            return next(iter(owners))
+        # Several owners (mafia, civilians): first one in player order
+        for p in self.players.values():
+            if p.alive and p.role == role:
+                return p.name
+        return None
+
+    def snapshot(self):
+        state = zlib.compress(state_json(self).encode(), SNAPSHOT_LEVEL)
+        self.snapshots.append((len(self.events), state))
+
+    def start_history(self):
+        """Snapshot the state before the first event"""
+        if not self.snapshots:
+            self.snapshot()
+
+    def record(self, command: str, args: tuple):
+        event = Event(command, args)
+        if self.batch_events is not None:
+            self.batch_events.append(event)
+            return
+        self.events.append(event)
+        if len(self.events) % SNAPSHOT_EVERY == 0:
+            self.snapshot()
+
+    def add_log(self, line: str):
+        self.log_lines.append(line)
+        self.log_seqs.append(self.log_next_seq)
+        self.log_next_seq += 1
+
+    # Player changes go through these methods so undo can journal them
+    def _journal(self, change: tuple):
+        if self.undo_stack:
+            self.undo_stack[-1].changes.append(change)
+
+    def _set_player_field(self, p: Player, attr: str, value):
+        if attr in ("alive", "role"):
+            self._index_player(p, -1)
+            setattr(p, attr, value)
+            self._index_player(p, 1)
+            self.invalidate_step_targets()
+        else:
+            setattr(p, attr, value)
+
+    def update_player(self, name: str, **fields):
+        p = self.players[name]
+        for attr, value in fields.items():
+            self._journal(("player", name, attr, getattr(p, attr)))
+            self._set_player_field(p, attr, value)
+
+    def add_player(self, player: Player):
+        self._journal(("add", player.name))
+        self.players[player.name] = player
+        self._index_player(player, 1)
+        self.invalidate_step_targets()
+
+    def remove_player(self, name: str):
+        if self.undo_stack:
+            self._journal(("remove", name, list(self.players).index(name), asdict(self.players[name])))
+        self._index_player(self.players.pop(name), -1)
+        self.invalidate_step_targets()
+
+    def protect_from_vote(self, name: str, day: int):
+        self._journal(("protect", name, self.protected_from_vote_day.get(name)))
+        self.protected_from_vote_day[name] = day
+
+    def push_undo(self):
+        if self.undo_batched and self.undo_stack:
+            return
+        c = self.night_choices
+        choices = tuple(getattr(c, name) for name in NightChoices.__slots__)
+        if self.undo_stack and self.undo_stack[-1].night_choices == choices:
+            # Most checkpoints do not touch night choices: share the previous tuple
+            choices = self.undo_stack[-1].night_choices
+        entry = UndoEntry(
+            stage=self.stage,
+            day=self.day,
+            night=self.night,
+            mayor_name=self.mayor_name,
+            successor_name=self.successor_name,
+            skip_vote_day=self.skip_vote_day,
+            intimidated_today=self.intimidated_today,
+            night_choices=choices,
+            # night_steps is only ever replaced, never changed in place, so it is shared
+            night_steps=self.night_steps,
+            night_step_index=self.night_step_index,
+            pending_step=self.pending_step,
+            last_boss_intimidate=self.last_boss_intimidate,
+            last_doctor=self.last_doctor,
+            last_courtesan=self.last_courtesan,
+            last_seer=self.last_seer,
+            last_monk_first=self.last_monk_first,
+            last_commissioner=self.last_commissioner,
+            avenger_pending=self.avenger_pending,
+            log_len=len(self.log_lines),
+        )
+        self.undo_stack.append(entry)
+
+    def pop_undo(self) -> bool:
+        if not self.undo_stack:
+            return False
+        entry = self.undo_stack.pop()
+
+        for change in reversed(entry.changes):
+            kind = change[0]
+            if kind == "player":
+                _, name, attr, old = change
+                self._set_player_field(self.players[name], attr, old)
+            elif kind == "add":
+                self._index_player(self.players.pop(change[1]), -1)
+            elif kind == "remove":
+                _, name, index, fields = change
+                player = Player(**fields)
+                items = list(self.players.items())
+                items.insert(index, (name, player))
+                self.players = dict(items)
+                self._index_player(player, 1)
+            elif kind == "protect":
+                _, name, old = change
+                if old is None:
+                    self.protected_from_vote_day.pop(name, None)
+                else:
+                    self.protected_from_vote_day[name] = old
+
+        self.stage = entry.stage
+        self.day = entry.day
+        self.night = entry.night
+        self.mayor_name = entry.mayor_name
+        self.successor_name = entry.successor_name
+        self.skip_vote_day = entry.skip_vote_day
+        self.intimidated_today = entry.intimidated_today
+        self.night_choices = NightChoices(*entry.night_choices)
+        self.night_steps = entry.night_steps
+        self.night_step_index = entry.night_step_index
+        self.pending_step = entry.pending_step
+        self.last_boss_intimidate = entry.last_boss_intimidate
+        self.last_doctor = entry.last_doctor
+        self.last_courtesan = entry.last_courtesan
+        self.last_seer = entry.last_seer
+        self.last_monk_first = entry.last_monk_first
+        self.last_commissioner = entry.last_commissioner
+        self.avenger_pending = entry.avenger_pending
+        # log_lines is append-only while undo entries exist
+        del self.log_lines[entry.log_len:]
+        del self.log_seqs[entry.log_len:]
+        self.invalidate_step_targets()
+        return True
+
+
+# ==========================
+# SERIALIZATION
+# ==========================
+def game_to_dict(g: Game, history: bool = False) -> dict:
+    """The game state; with history, also its events and snapshots (export)"""
+    d = asdict(g)
+    if history:
+        d["events"] = [event_to_list(event) for event in g.events]
+        d["snapshots"] = [(n, base64.b64encode(state).decode("ascii")) for n, state in g.snapshots]
+    return d
+
+
+def undo_night_choices(values) -> tuple:
+    # Games saved by older versions keep the undo copy of night choices as a dict
+    if isinstance(values, dict):
+        values = [values.get(name) for name in NightChoices.__slots__]
+    return tuple(values)
+
+
+def game_from_dict(d: dict) -> Game:
+    events = d.pop("events", ())
+    snapshots = d.pop("snapshots", ())
+    # json.loads makes a new string for every occurrence of a name; log lines are left alone
+    d = {k: v if k == "log_lines" else interned(v) for k, v in d.items()}
+    d["stage"] = Stage(d["stage"])
+    d["players"] = {n: Player(**p) for n, p in d["players"].items()}
+    d["bind_stack"] = [tuple(item) for item in d["bind_stack"]]
+    d["night_choices"] = NightChoices(**d["night_choices"])
+    d["undo_stack"] = [
+        UndoEntry(**{
+            **entry,
+            "stage": Stage(entry["stage"]),
+            "night_choices": undo_night_choices(entry["night_choices"]),
+            "changes": [tuple(change) for change in entry["changes"]],
+        })
+        for entry in d["undo_stack"]
+    ]
+    g = Game(**d)
+    # Exports carry the history; games saved without it start it with their next action
+    for event in events:
+        g.events.append(event_from_dict(event) if isinstance(event, dict) else event_from_list(event))
+    g.snapshots = [(n, base64.b64decode(state)) for n, state in snapshots]
+    return g
+
+
+def game_to_json(g: Game, history: bool = False) -> str:
+    return json.dumps(game_to_dict(g, history), ensure_ascii=False, separators=(",", ":"))
+
+
+def game_from_json(data: str) -> Game:
+    return game_from_dict(json.loads(data))
+
+
+def state_json(g: Game) -> str:
+    """The state snapshots hold: game_to_json, which leaves the history out"""
+    return game_to_json(g)
+
+
+# ==========================
+# HELPER FUNCTIONS
+# ==========================
+def init_default_roles(g: Game):
+    g.role_counts = {
+        ROLE_BOSS: 1,
+        ROLE_DOCTOR: 1,
+        ROLE_COURTESAN: 1,
+        ROLE_MAFIA: 1,
+        ROLE_AVENGER: 0,
+        ROLE_IMMORTAL: 0,
+        ROLE_RAT: 0,
+        ROLE_COMMISSIONER: 0,
+        ROLE_DUKE: 0,
+        ROLE_BANSHEE: 0,
+        ROLE_MANIAC: 0,
+        ROLE_MONK: 0,
+        ROLE_SEER: 0,
+        ROLE_CIVIL: 0,
+    }
+
+
+def roles_sum(g: Game) -> int:
+    return sum(g.role_counts.values())
+
+
+def role_constraints_ok(g: Game) -> Tuple[bool, str]:
+    if g.role_counts.get(ROLE_BOSS, 0) != 1:
+        return False, "Босс мафии должен быть ровно 1."
+    if g.role_counts.get(ROLE_DOCTOR, 0) != 1:
+        return False, "Доктор должен быть ровно 1."
+    if g.role_counts.get(ROLE_COURTESAN, 0) != 1:
+        return False, "Куртизанка должна быть ровно 1."
+    if g.role_counts.get(ROLE_MAFIA, 0) < 1:
+        return False, "Мафия должна быть минимум 1."
+    for r in [ROLE_AVENGER, ROLE_IMMORTAL, ROLE_RAT, ROLE_COMMISSIONER, ROLE_DUKE,
+              ROLE_BANSHEE, ROLE_MANIAC, ROLE_MONK, ROLE_SEER]:
+        if g.role_counts.get(r, 0) not in (0, 1):
+            return False, f"Роль {r} может быть только 0 или 1."
+    if len(g.players) <= 0:
+        return False, "Добавьте игроков."
+    if roles_sum(g) != len(g.players):
+        return False, f"Сумма ролей ({roles_sum(g)}) должна равняться числу игроков ({len(g.players)})."
+    return True, "OK"
+
+
+def special_threshold_blocks(g: Game) -> bool:
+    """Check if special abilities are blocked due to threshold"""
+    mafia = g.mafia_alive_count()
+    peace = g.peace_alive_count()
+    return (peace == 2 and mafia == 1) or (peace == 3 and mafia == 2)
+
+
+def check_end(g: Game) -> Optional[str]:
+    """Check game end conditions"""
+    mafia = g.mafia_alive_count()
+    peace = g.peace_alive_count()
+    maniac = 1 if g.maniac_alive() else 0
+    total = g.alive_count()
+
+    if total == 3 and mafia == 1 and peace == 1 and maniac == 1:
+        return "Ничья (1 мирный, 1 мафия, 1 маньяк)"
+
+    if mafia == 0:
+        return "Победа мирных (вся мафия уничтожена)"
+
+    if mafia > 0 and mafia >= peace:
+        return "Победа мафии (мафия >= мирные)"
+
+    return None
+
+
+def boss_intimidation_allowed(g: Game) -> bool:
+    """Check if boss can use intimidation"""
+    mafia = g.mafia_alive_count()
+    peace = g.peace_alive_count()
+    if g.role_alive_exists(ROLE_BOSS) and mafia == 1 and peace == 3:
+        return False
+    return g.role_alive_exists(ROLE_BOSS)
+
+
+def build_night_steps(g: Game) -> List[str]:
+    """Build list of night action steps"""
+    steps: List[str] = []
+    if g.mafia_alive_count() > 0:
+        steps.append("mafia_kill")
+    if boss_intimidation_allowed(g):
+        steps.append("boss_intimidate")
+    if g.role_alive_exists(ROLE_MANIAC):
+        steps.append("maniac_kill")
+    if g.role_alive_exists(ROLE_COMMISSIONER):
+        steps.append("commissioner_check")
+    if g.role_alive_exists(ROLE_MONK):
+        steps.append("monk_first")
+        steps.append("monk_second")
+    if g.role_alive_exists(ROLE_DOCTOR):
+        steps.append("doctor_heal")
+    if g.role_alive_exists(ROLE_COURTESAN):
+        steps.append("courtesan_visit")
+    if g.role_alive_exists(ROLE_SEER):
+        steps.append("seer_divine")
+    if g.mafia_alive_count() == 1 and g.role_alive_exists(ROLE_RAT):
+        steps.append("rat_wants")
+        steps.append("mafia_wants_rat")
+    return steps
+
+
+# Every night step, with its human-readable title
+STEP_TITLES = {
+    "mafia_kill": "Мафия убивает",
+    "boss_intimidate": "Босс мафии запугивает",
+    "maniac_kill": "Маньяк убивает",
+    "commissioner_check": "Комиссар проверяет",
+    "monk_first": "Монах (1-е указание)",
+    "monk_second": "Монах (2-е указание)",
+    "doctor_heal": "Доктор лечит",
+    "courtesan_visit": "Куртизанка идёт к",
+    "seer_divine": "Гадалка гадает",
+    "rat_wants": "Крыса хочет стать мафией?",
+    "mafia_wants_rat": "Мафия хочет крысу?",
+}
+
+
+def get_step_title(step: str) -> str:
+    """Get human-readable title for night step"""
+    return STEP_TITLES.get(step, step)
+
+
+def get_step_targets(g: Game, step: str) -> List[str]:
+    """Get available targets for a night step"""
+    alive = g.alive_names()
+
+    if step == "mafia_kill":
+        return [n for n in alive if not is_mafia_role(g.players[n].role)]
+
+    elif step == "boss_intimidate":
+        targets = alive[:]
+        if g.last_boss_intimidate:
+            targets = [n for n in targets if n != g.last_boss_intimidate]
+        return targets
+
+    elif step == "maniac_kill":
+        maniac_name = g.get_role_owner(ROLE_MANIAC)
+        return [n for n in alive if n != maniac_name]
+
+    elif step == "commissioner_check":
+        comm = g.get_role_owner(ROLE_COMMISSIONER)
+        targets = [n for n in alive if n != comm]
+        if g.last_commissioner:
+            targets = [n for n in targets if n != g.last_commissioner]
+        return targets
+
+    elif step == "monk_first":
+        targets = alive[:]
+        if g.last_monk_first:
+            targets = [n for n in targets if n != g.last_monk_first]
+        return targets
+
+    elif step == "monk_second":
+        monk = g.get_role_owner(ROLE_MONK)
+        return [n for n in alive if n != monk and n != g.night_choices.monk_first]
+
+    elif step == "doctor_heal":
+        targets = alive[:]
+        if g.last_doctor:
+            targets = [n for n in targets if n != g.last_doctor]
+        return targets
+
+    elif step == "courtesan_visit":
+        courtesan = g.get_role_owner(ROLE_COURTESAN)
+        targets = [n for n in alive if n != courtesan]
+        if g.last_courtesan:
+            targets = [n for n in targets if n != g.last_courtesan]
+        return targets
+
+    elif step == "seer_divine":
+        targets = alive[:]
+        if g.last_seer:
+            targets = [n for n in targets if n != g.last_seer]
+        return targets
+
+    return []
+
+
+YESNO_STEPS = ("rat_wants", "mafia_wants_rat")
+
+
+def cached_step_targets(g: Game, step: str) -> List[str]:
+    """get_step_targets, cached on the game until something it depends on changes"""
+    targets = g.step_targets_cache.get(step)
+    if targets is None:
+        targets = g.step_targets_cache[step] = get_step_targets(g, step)
+    return targets
+
+
+def commissioner_answer_for(g: Game, target: str) -> str:
+    """Get commissioner check result"""
+    role = g.players[target].role if target in g.players else None
+    if role in {ROLE_RAT, ROLE_RAT_MAFIA}:
+        return "НЕТ, не мафия"
+    return "ДА, мафия" if is_mafia_role(role) else "НЕТ, не мафия"
+
+
+def apply_night_and_get_deaths(g: Game) -> Tuple[List[str], List[str]]:
+    """Apply night actions and return (deaths, summary)"""
+    c = g.night_choices
+    deaths: Set[str] = set()
+    summary: List[str] = []
+
+    def alive(name: Optional[str]) -> bool:
+        return bool(name) and name in g.players and g.players[name].alive
+
+    def role_of(name: str) -> Optional[str]:
+        return g.players[name].role if name in g.players else None
+
+    def is_immortal(name: str) -> bool:
+        return alive(name) and role_of(name) == ROLE_IMMORTAL
+
+    # defenders
+    courtesan_alive = g.role_alive_exists(ROLE_COURTESAN)
+    courtesan_name = g.get_role_owner(ROLE_COURTESAN) if courtesan_alive else None
+    client = c.courtesan_client if courtesan_alive and alive(c.courtesan_client) else None
+    doctor_target = c.doctor_target if g.role_alive_exists(ROLE_DOCTOR) and alive(c.doctor_target) else None
+
+    mafia_intended = c.mafia_target if alive(c.mafia_target) else None
+    maniac_intended = c.maniac_target if g.role_alive_exists(ROLE_MANIAC) and alive(c.maniac_target) else None
+
+    # monk redirect
+    monk_active = g.role_alive_exists(ROLE_MONK) and alive(c.monk_first) and alive(c.monk_second)
+    mafia_actual = mafia_intended
+    maniac_actual = maniac_intended
+
+    if monk_active:
+        if mafia_intended and c.monk_first == mafia_intended:
+            mafia_actual = c.monk_second
+        if maniac_intended and c.monk_first == maniac_intended:
+            maniac_actual = c.monk_second
+
+    def saved_by_doctor(t: str) -> bool:
+        return doctor_target == t
+
+    def saved_by_courtesan(t: str) -> bool:
+        return client == t
+
+    def kill_logic(target: Optional[str]):
+        if not target or not alive(target):
+            return
+        if is_immortal(target):
+            return
+        if saved_by_courtesan(target):
+            return
+        if courtesan_alive and courtesan_name == target:
+            if saved_by_doctor(target):
+                return
+            deaths.add(target)
+            if client and alive(client) and not is_immortal(client):
+                deaths.add(client)
+            return
+        if saved_by_doctor(target):
+            return
+        deaths.add(target)
+
+    if mafia_actual:
+        kill_logic(mafia_actual)
+    if maniac_actual:
+        kill_logic(maniac_actual)
+
+    # Build summary
+    def outcome(killer_label: str, intended: Optional[str], actual: Optional[str]) -> Optional[str]:
+        if not intended:
+            return None
+        if not actual:
+            return f"{killer_label}: не выбрано"
+        if actual in deaths:
+            result = f"{killer_label}: {intended}"
+            if actual != intended:
+                result += f" → {actual}"
+            return result + " — УБИТ"
+        if is_immortal(actual):
+            reason = "бессмертный"
+        elif saved_by_courtesan(actual):
+            reason = "спасла куртизанка"
+        elif saved_by_doctor(actual):
+            reason = "спас доктор"
+        else:
+            reason = "выжил"
+        result = f"{killer_label}: {intended}"
+        if actual != intended:
+            result += f" → {actual}"
+        return result + f" — ВЫЖИЛ ({reason})"
+
+    if mafia_intended:
+        s = outcome("Мафия стреляла", mafia_intended, mafia_actual)
+        if s:
+            summary.append(s)
+
+    if boss_intimidation_allowed(g) and alive(c.boss_intimidate):
+        summary.append(f"Босс мафии запугал {c.boss_intimidate}")
+
+    if maniac_intended:
+        s = outcome("Маньяк выбрал", maniac_intended, maniac_actual)
+        if s:
+            summary.append(s)
+
+    if alive(c.commissioner_target) and g.role_alive_exists(ROLE_COMMISSIONER):
+        summary.append(f"Комиссар проверил {c.commissioner_target}: {commissioner_answer_for(g, c.commissioner_target)}")
+
+    if monk_active:
+        summary.append(f"Монах: 1-е {c.monk_first}, 2-е {c.monk_second}")
+
+    if doctor_target:
+        summary.append(f"Доктор лечил {doctor_target}")
+
+    if client:
+        summary.append(f"Куртизанка была с {client}")
+
+    if alive(c.seer_target) and g.role_alive_exists(ROLE_SEER):
+        summary.append(f"Гадалка выбрала {c.seer_target}")
+
+    if g.mafia_alive_count() == 1 and g.role_alive_exists(ROLE_RAT):
+        if c.rat_wants is not None and c.mafia_wants_rat is not None:
+            summary.append(f"Крыса хочет стать мафией: {'ДА' if c.rat_wants else 'НЕТ'}")
+            summary.append(f"Мафия хочет крысу: {'ДА' if c.mafia_wants_rat else 'НЕТ'}")
+
+    return sorted(deaths), summary
+
+
+def handle_mayor_death(g: Game, died: str):
+    """Handle mayor death and succession"""
+    if died != g.mayor_name:
+        return
+    succ = g.successor_name
+    if succ and succ in g.players and g.players[succ].alive:
+        g.update_player(succ, is_successor=False, is_mayor=True)
+        g.mayor_name = succ
+        g.successor_name = None
+        # Protect successor on their first FULL day as mayor (next day)
+        g.protect_from_vote(succ, g.day + 1)
+
+
+# ==========================
+# ACTIONS
+# ==========================
+# command name -> action, for replaying events
+EVENT_HANDLERS: Dict[str, Callable[..., dict]] = {}
+
+
+def command(fn):
+    """Record every successful call of the action as an Event on the game"""
+    params = dict(list(inspect.signature(fn).parameters.items())[1:])
+
+    defaults = {name: p.default for name, p in params.items()}
+
+    @functools.wraps(fn)
+    def wrapper(g: Game, *args, **kwargs):
+        if not g.history:
+            return fn(g, *args, **kwargs)
+        g.start_history()
+        result = fn(g, *args, **kwargs)
+        if kwargs:
+            args += tuple(kwargs.get(name, defaults[name]) for name in list(params)[len(args):])
+        g.record(fn.__name__, args)
+        return result
+
+    EVENT_HANDLERS[fn.__name__] = wrapper
+    return wrapper
+
+
+@contextmanager
+def batch(g: Game):
+    """Actions inside share one undo checkpoint and are recorded as one "batch" event.
+
+    If the block raises, nothing is recorded (the caller discards the game).
+    """
+    if g.history:
+        g.start_history()
+    g.push_undo()
+    g.undo_batched = True
+    g.batch_events = []
+    try:
+        yield
+    finally:
+        g.undo_batched = False
+        events, g.batch_events = g.batch_events, None
+    if g.history:
+        g.record("batch", tuple(events))
+
+
+def apply_event(g: Game, event: Event):
+    if event.command == "batch":
+        with batch(g):
+            for inner in event.args:
+                apply_event(g, inner)
+        return
+    EVENT_HANDLERS[event.command](g, *event.args)
+
+
+def rebuild(g: Game, upto: Optional[int] = None) -> Game:
+    """A new game equal to g as it was after its first `upto` events (all by default).
+
+    Starts from the nearest snapshot at or before `upto` and replays the events after it.
+    """
+    upto = len(g.events) if upto is None else upto
+    if not g.snapshots or not g.snapshots[0][0] <= upto <= len(g.events):
+        raise ValueError(f"No history for event {upto}")
+    counts = [count for count, _ in g.snapshots]
+    n, state = g.snapshots[bisect.bisect_right(counts, upto) - 1]
+    new = game_from_json(zlib.decompress(state).decode())
+    new.events = EventLog(g.events.encoded(0, n))
+    new.snapshots = [snapshot for snapshot in g.snapshots if snapshot[0] <= n]
+    for event in g.events[n:upto]:
+        apply_event(new, event)
+    new.version = g.version
+    return new
+
+
+@command
+def add_player(g: Game, player_name: str) -> dict:
+    """Add a player to the game"""
+    if g.stage not in [Stage.LOBBY, Stage.ADD_PLAYERS, Stage.EDIT_PARTICIPANTS]:
+        raise GameError("Нельзя добавить игрока на этом этапе")
+
+    name = sys.intern(player_name.strip())
+    if not name:
+        raise GameError("Имя не может быть пустым")
+
+    if name in g.players:
+        raise GameError("Игрок уже существует")
+
+    g.add_player(Player(name=name))
+    g.stage = Stage.ADD_PLAYERS
+
+    return {"message": f"Игрок {name} добавлен", "players_count": len(g.players)}
+
+
+@command
+def remove_player(g: Game, player_name: str) -> dict:
+    """Remove a player from the game"""
+    if g.stage not in [Stage.LOBBY, Stage.ADD_PLAYERS, Stage.EDIT_PARTICIPANTS, Stage.REMOVE_PLAYER, Stage.PRESTART]:
+        raise GameError("Нельзя удалить игрока на этом этапе")
+
+    if player_name not in g.players:
+        raise GameError("Игрок не найден", status_code=404)
+
+    g.remove_player(player_name)
+
+    return {"message": f"Игрок {player_name} удалён", "players_count": len(g.players)}
+
+
+@command
+def set_role_count(g: Game, role: str, count: int) -> dict:
+    """Set role count"""
+    if count < 0:
+        raise GameError("Количество не может быть отрицательным")
+
+    # Validate fixed roles
+    fixed = {ROLE_BOSS, ROLE_DOCTOR, ROLE_COURTESAN}
+    if role in fixed and count != 1:
+        raise GameError(f"Роль {role} должна быть ровно 1")
+
+    # Validate optional max1 roles
+    optional_max1 = {ROLE_AVENGER, ROLE_IMMORTAL, ROLE_RAT, ROLE_COMMISSIONER, ROLE_DUKE,
+                     ROLE_BANSHEE, ROLE_MANIAC, ROLE_MONK, ROLE_SEER}
+    if role in optional_max1 and count > 1:
+        raise GameError(f"Роль {role} может быть только 0 или 1")
+
+    # Validate mafia minimum
+    if role == ROLE_MAFIA and count < 1:
+        raise GameError("Мафия должна быть минимум 1")
+
+    if count == 0:
+        g.role_counts.pop(role, None)
+    else:
+        g.role_counts[role] = count
+
+    g.stage = Stage.EDIT_ROLES
+
+    return {"message": f"Роль {role}: {count}", "roles_sum": roles_sum(g)}
+
+
+@command
+def set_stage(g: Game, stage: str) -> dict:
+    """Set game stage (for navigation)"""
+    try:
+        new_stage = Stage(stage)
+    except ValueError:
+        raise GameError(f"Неизвестный этап: {stage}")
+
+    g.stage = new_stage
+    return {"message": f"Этап: {new_stage}", "stage": new_stage}
+
+
+def validate_start(g: Game) -> dict:
+    """Validate if game can start"""
+    ok, msg = role_constraints_ok(g)
+    return {"valid": ok, "message": msg}
+
+
+@command
+def start_game(g: Game) -> dict:
+    """Start the game (begin Night 0 - role binding)"""
+    ok, msg = role_constraints_ok(g)
+    if not ok:
+        raise GameError(msg)
+
+    # Reset runtime state
+    g.day = 0
+    g.night = 0
+    g.skip_vote_day = None
+    g.undo_stack = []
+
+    g.night_choices = NightChoices()
+    g.night_steps = []
+    g.night_step_index = 0
+    g.pending_step = None
+
+    g.last_boss_intimidate = None
+    g.last_doctor = None
+    g.last_courtesan = None
+    g.last_seer = None
+    g.last_monk_first = None
+    g.last_commissioner = None
+    g.invalidate_step_targets()
+
+    g.avenger_pending = None
+    g.mayor_name = None
+    g.successor_name = None
+    g.protected_from_vote_day = {}
+    g.intimidated_today = None
+    g.log_lines = []
+    g.log_seqs = []
+    g.add_log("Ночь 0: привязка ролей началась.")
+
+    for name in g.players:
+        g.update_player(name, alive=True, role=None, is_mayor=False, is_successor=False)
+
+    # Setup binding
+    g.bind_remaining = copy.deepcopy(g.role_counts)
+    g.bind_available_players = sorted(list(g.players.keys()))
+    g.bind_stack = []
+    g.bind_selected_role = None
+
+    g.stage = Stage.NIGHT0_BIND_ROLE
+
+    return {"message": "Ночь 0 началась", "stage": g.stage}
+
+
+@command
+def bind_role(g: Game, role: str) -> dict:
+    """Select a role to bind (Night 0)"""
+    if g.stage != Stage.NIGHT0_BIND_ROLE:
+        raise GameError("Неверный этап")
+
+    if g.bind_remaining.get(role, 0) <= 0:
+        raise GameError("Эта роль уже занята")
+
+    g.bind_selected_role = role
+    g.stage = Stage.NIGHT0_BIND_PLAYER
+
+    return {"message": f"Выбрана роль: {role}", "stage": g.stage}
+
+
+@command
+def bind_player(g: Game, player_name: str) -> dict:
+    """Bind selected role to a player (Night 0)"""
+    if g.stage != Stage.NIGHT0_BIND_PLAYER:
+        raise GameError("Неверный этап")
+
+    role = g.bind_selected_role
+    name = player_name
+
+    if not role or name not in g.bind_available_players:
+        raise GameError("Недоступно")
+
+    g.update_player(name, role=role)
+    g.bind_available_players.remove(name)
+    g.bind_remaining[role] -= 1
+    g.bind_stack.append((name, role))
+    g.add_log(f"Ночь 0: {name} → {role}")
+    g.bind_selected_role = None
+
+    # Check if binding is complete
+    if sum(g.bind_remaining.values()) == 0 and len(g.bind_available_players) == 0:
+        g.stage = Stage.MAYOR_SELECT
+        g.add_log("Ночь 0: привязка завершена.")
+        return {"message": "Привязка завершена. Выберите мэра.", "stage": g.stage, "binding_complete": True}
+
+    g.stage = Stage.NIGHT0_BIND_ROLE
+    return {"message": f"{name} → {role}", "stage": g.stage, "binding_complete": False}
+
+
+@command
+def bind_undo(g: Game) -> dict:
+    """Undo last role binding (Night 0)"""
+    if g.stage not in [Stage.NIGHT0_BIND_ROLE, Stage.NIGHT0_BIND_PLAYER]:
+        raise GameError("Неверный этап")
+
+    if not g.bind_stack:
+        raise GameError("Нечего отменять")
+
+    name, role = g.bind_stack.pop()
+    g.update_player(name, role=None)
+    g.bind_available_players.append(name)
+    g.bind_available_players.sort()
+    g.bind_remaining[role] += 1
+    g.bind_selected_role = None
+    g.stage = Stage.NIGHT0_BIND_ROLE
+    g.add_log(f"Ночь 0: ОТМЕНА {name} → {role}")
+
+    return {"message": "Отменено", "stage": g.stage}
+
+
+@command
+def select_mayor(g: Game, player_name: str) -> dict:
+    """Select the mayor"""
+    if g.stage != Stage.MAYOR_SELECT:
+        raise GameError("Неверный этап")
+
+    name = player_name
+    if name not in g.players or not g.players[name].alive:
+        raise GameError("Недоступно")
+
+    g.mayor_name = name
+    g.update_player(name, is_mayor=True)
+    g.day = 1
+    g.protect_from_vote(name, 1)
+    g.add_log(f"Ночь 0: мэр → {name} (защита от голосования День 1)")
+
+    g.stage = Stage.SUCCESSOR_SELECT
+
+    return {"message": f"Мэр: {name}", "stage": g.stage}
+
+
+@command
+def select_successor(g: Game, player_name: str) -> dict:
+    """Select the mayor's successor"""
+    if g.stage != Stage.SUCCESSOR_SELECT:
+        raise GameError("Неверный этап")
+
+    name = player_name
+    if name == g.mayor_name or name not in g.players or not g.players[name].alive:
+        raise GameError("Недоступно")
+
+    g.successor_name = name
+    g.update_player(name, is_successor=True)
+    g.add_log(f"Ночь 0: преемник → {name}")
+
+    g.stage = Stage.DAY_MENU
+
+    return {"message": f"Преемник: {name}. Игра началась!", "stage": g.stage}
+
+
+@command
+def day_vote_start(g: Game) -> dict:
+    """Start day voting"""
+    if g.stage != Stage.DAY_MENU:
+        raise GameError("Неверный этап")
+
+    if g.skip_vote_day == g.day:
+        raise GameError("Сегодня голосования нет (траур)")
+
+    g.push_undo()
+    g.stage = Stage.DAY_VOTE_PICK
+
+    return {"message": f"День {g.day}: голосование", "stage": g.stage}
+
+
+@command
+def day_vote(g: Game, target: str) -> dict:
+    """Vote to eliminate a player during the day"""
+    if g.stage != Stage.DAY_VOTE_PICK:
+        raise GameError("Неверный этап")
+
+    name = target
+    if name not in g.players or not g.players[name].alive:
+        raise GameError("Недоступно")
+
+    # Check if protected
+    if g.protected_from_vote_day.get(name) == g.day:
+        raise GameError("Этот игрок защищён от голосования сегодня")
+
+    g.update_player(name, alive=False)
+    role = g.players[name].role or "неизвестно"
+    g.add_log(f"День {g.day}: голосованием убит {name} ({role})")
+
+    handle_mayor_death(g, name)
+
+    # Check for Banshee (cancels night)
+    if role == ROLE_BANSHEE and not special_threshold_blocks(g):
+        g.day += 1
+        g.stage = Stage.DAY_MENU
+
+        result = check_end(g)
+        if result:
+            g.stage = Stage.END
+            g.add_log(f"Итог: {result}")
+            return {
+                "message": f"{name} убит ({role}). Банши: ночь отменена.",
+                "stage": g.stage,
+                "game_ended": True,
+                "end_result": result,
+                "special": "banshee_no_night",
+            }
+
+        return {
+            "message": f"{name} убит ({role}). Банши: ночь отменена. День {g.day}",
+            "stage": g.stage,
+            "game_ended": False,
+            "special": "banshee_no_night",
+        }
+
+    # Check for Avenger (revenge)
+    if role == ROLE_AVENGER:
+        g.avenger_pending = name
+        g.stage = Stage.AVENGER_REVENGE_PICK
+        return {
+            "message": f"{name} убит ({role}). Мститель выбирает цель.",
+            "stage": g.stage,
+            "game_ended": False,
+            "special": "avenger_revenge",
+        }
+
+    # Check game end
+    result = check_end(g)
+    if result:
+        g.stage = Stage.END
+        g.add_log(f"Итог: {result}")
+        return {
+            "message": f"{name} убит ({role})",
+            "stage": g.stage,
+            "game_ended": True,
+            "end_result": result,
+        }
+
+    # Check final threshold (2 peaceful + 1 mafia = no night)
+    mafia = g.mafia_alive_count()
+    peace = g.peace_alive_count()
+    total = g.alive_count()
+
+    if total == 3 and mafia == 1 and peace == 2:
+        g.add_log(f"День {g.day}: осталось 3 (2 мирных + 1 мафия) — ночь отменена.")
+        g.day += 1
+        g.stage = Stage.DAY_MENU
+
+        result2 = check_end(g)
+        if result2:
+            g.stage = Stage.END
+            g.add_log(f"Итог: {result2}")
+            return {
+                "message": f"{name} убит ({role}). Финал: ночь отменена.",
+                "stage": g.stage,
+                "game_ended": True,
+                "end_result": result2,
+                "special": "final_threshold",
+            }
+
+        return {
+            "message": f"{name} убит ({role}). Финал: ночь отменена. День {g.day}",
+            "stage": g.stage,
+            "game_ended": False,
+            "special": "final_threshold",
+        }
+
+    # Transition to night
+    return begin_night(g, f"{name} убит ({role})")
+
+
+@command
+def avenger_revenge(g: Game, target: str) -> dict:
+    """Avenger selects revenge target"""
+    if g.stage != Stage.AVENGER_REVENGE_PICK:
+        raise GameError("Неверный этап")
+
+    target = target
+    if target not in g.players or not g.players[target].alive:
+        raise GameError("Недоступно")
+
+    if target == g.avenger_pending:
+        raise GameError("Нельзя выбрать себя")
+
+    g.update_player(target, alive=False)
+    role_t = g.players[target].role or "неизвестно"
+    g.add_log(f"День {g.day}: месть — убит {target} ({role_t})")
+
+    handle_mayor_death(g, target)
+    g.avenger_pending = None
+
+    # Check for Banshee (cancels night)
+    if role_t == ROLE_BANSHEE and not special_threshold_blocks(g):
+        g.day += 1
+        g.stage = Stage.DAY_MENU
+
+        result = check_end(g)
+        if result:
+            g.stage = Stage.END
+            g.add_log(f"Итог: {result}")
+            return {
+                "message": f"Месть: {target} убит ({role_t}). Банши: ночь отменена.",
+                "stage": g.stage,
+                "game_ended": True,
+                "end_result": result,
+                "special": "banshee_no_night",
+            }
+
+        return {
+            "message": f"Месть: {target} убит ({role_t}). Банши: ночь отменена. День {g.day}",
+            "stage": g.stage,
+            "game_ended": False,
+            "special": "banshee_no_night",
+        }
+
+    # Check game end
+    result = check_end(g)
+    if result:
+        g.stage = Stage.END
+        g.add_log(f"Итог: {result}")
+        return {
+            "message": f"Месть: {target} убит ({role_t})",
+            "stage": g.stage,
+            "game_ended": True,
+            "end_result": result,
+        }
+
+    # Transition to night
+    return begin_night(g, f"Месть: {target} убит ({role_t})")
+
+
+def begin_night(g: Game, prefix: str = "") -> dict:
+    """Start the next night: undo checkpoint, steps and their targets"""
+    g.night += 1
+    g.stage = Stage.NIGHT_MENU
+    g.undo_stack = []
+    g.intimidated_today = None  # Clear intimidation when night starts
+    g.push_undo()
+
+    g.night_choices = NightChoices()
+    g.night_steps = build_night_steps(g)
+    g.night_step_index = 0
+    g.pending_step = None
+
+    # Targets only change on deaths, monk_first and undo: compute them once per night
+    g.invalidate_step_targets()
+    for step in g.night_steps:
+        if step not in YESNO_STEPS:
+            cached_step_targets(g, step)
+
+    return {
+        "message": f"{prefix} Наступает ночь {g.night}.",
+        "stage": g.stage,
+        "game_ended": False,
+        "night": g.night,
+    }
+
+
+@command
+def skip_to_night(g: Game) -> dict:
+    """Skip day voting (mourning) and go to night"""
+    if g.stage != Stage.DAY_MENU:
+        raise GameError("Неверный этап")
+
+    if g.skip_vote_day != g.day:
+        raise GameError("Сегодня голосование есть")
+
+    return begin_night(g, "Траур: голосования нет.")
+
+
+@command
+def night_action(g: Game, target: Optional[str] = None, choice: Optional[bool] = None) -> dict:
+    """Perform a night action"""
+    if g.stage != Stage.NIGHT_MENU:
+        raise GameError("Неверный этап")
+
+    if g.night_step_index >= len(g.night_steps):
+        raise GameError("Все шаги выполнены")
+
+    step = g.night_steps[g.night_step_index]
+    # Checked before the undo checkpoint: a refused action is not recorded, so it must not change the game
+    if step not in STEP_TITLES:
+        raise GameError(f"Неизвестный шаг: {step}")
+    if step in YESNO_STEPS:
+        if choice is None:
+            raise GameError("Сделайте выбор")
+    elif not target:
+        raise GameError("Выберите цель")
+    g.push_undo()
+
+    result_message = ""
+
+    if step == "mafia_kill":
+        g.night_choices.mafia_target = target
+        result_message = f"Мафия выбрала: {target}"
+
+    elif step == "boss_intimidate":
+        g.night_choices.boss_intimidate = target
+        result_message = f"Босс запугал: {target}"
+
+    elif step == "maniac_kill":
+        g.night_choices.maniac_target = target
+        result_message = f"Маньяк выбрал: {target}"
+
+    elif step == "commissioner_check":
+        g.night_choices.commissioner_target = target
+        answer = commissioner_answer_for(g, target)
+        g.last_commissioner = target
+        result_message = f"Комиссар проверил {target}: {answer}"
+
+    elif step == "monk_first":
+        g.night_choices.monk_first = target
+        g.last_monk_first = target
+        result_message = f"Монах (1-е): {target}"
+
+    elif step == "monk_second":
+        g.night_choices.monk_second = target
+        result_message = f"Монах (2-е): {target}"
+
+    elif step == "doctor_heal":
+        g.night_choices.doctor_target = target
+        g.last_doctor = target
+        result_message = f"Доктор лечит: {target}"
+
+    elif step == "courtesan_visit":
+        g.night_choices.courtesan_client = target
+        g.last_courtesan = target
+        result_message = f"Куртизанка идёт к: {target}"
+
+    elif step == "seer_divine":
+        g.night_choices.seer_target = target
+        g.last_seer = target
+        result_message = f"Гадалка выбрала: {target}"
+
+    elif step == "rat_wants":
+        g.night_choices.rat_wants = choice
+        result_message = f"Крыса хочет стать мафией: {'ДА' if choice else 'НЕТ'}"
+
+    elif step == "mafia_wants_rat":
+        g.night_choices.mafia_wants_rat = choice
+        result_message = f"Мафия хочет крысу: {'ДА' if choice else 'НЕТ'}"
+
+    # The step's own last_* restriction changed; monk_second excludes monk_first
+    if step == "monk_first":
+        g.invalidate_step_targets(step, "monk_second")
+    else:
+        g.invalidate_step_targets(step)
+
+    # Advance to next step
+    g.night_step_index += 1
+
+    return {
+        "message": result_message,
+        "stage": g.stage,
+        "step_completed": step,
+        "steps_remaining": len(g.night_steps) - g.night_step_index,
+    }
+
+
+@command
+def finish_night(g: Game) -> dict:
+    """Finish the night and apply all actions"""
+    if g.stage != Stage.NIGHT_MENU:
+        raise GameError("Неверный этап")
+
+    if g.night_step_index < len(g.night_steps):
+        raise GameError("Сначала выполните все ночные шаги")
+
+    c = g.night_choices
+
+    # Handle rat transformation
+    if g.mafia_alive_count() == 1 and g.role_alive_exists(ROLE_RAT):
+        if c.rat_wants is not None and c.mafia_wants_rat is not None:
+            if c.rat_wants and c.mafia_wants_rat:
+                rat_name = g.get_role_owner(ROLE_RAT)
+                if rat_name:
+                    g.update_player(rat_name, role=ROLE_RAT_MAFIA)
+                    g.add_log(f"Ночь {g.night}: крыса {rat_name} стала {ROLE_RAT_MAFIA}")
+            else:
+                g.add_log(f"Ночь {g.night}: крыса не стала мафией")
+
+    # Apply night actions
+    deaths, summary = apply_night_and_get_deaths(g)
+
+    # Log night actions
+    for s in summary:
+        g.add_log(f"Ночь {g.night}: {s}")
+
+    # Process deaths
+    killed_names = []
+    for name in deaths:
+        if name in g.players and g.players[name].alive:
+            g.update_player(name, alive=False)
+            role = g.players[name].role or "неизвестно"
+            killed_names.append(f"{name} ({role})")
+            g.add_log(f"Ночь {g.night}: убит {name} ({role})")
+            handle_mayor_death(g, name)
+
+    # Check for Duke (mourning next day)
+    if not special_threshold_blocks(g):
+        for name in deaths:
+            if name in g.players and g.players[name].role == ROLE_DUKE:
+                g.skip_vote_day = g.day + 1
+                g.add_log(f"Ночь {g.night}: Герцог убит — траур в день {g.skip_vote_day}")
+                break
+
+    # Check game end
+    result = check_end(g)
+    killed_text = ", ".join(killed_names) if killed_names else "никто не умер"
+
+    if result:
+        g.stage = Stage.END
+        g.add_log(f"Итог: {result}")
+        return {
+            "message": f"Ночь {g.night}: {killed_text}",
+            "stage": g.stage,
+            "game_ended": True,
+            "end_result": result,
+            "deaths": killed_names,
+            "summary": summary,
+        }
+
+    # Transition to day
+    g.day += 1
+    g.stage = Stage.DAY_MENU
+
+    # Apply boss intimidation (player can't speak/vote today)
+    c = g.night_choices
+    if boss_intimidation_allowed(g) and c.boss_intimidate and c.boss_intimidate in g.players and g.players[c.boss_intimidate].alive:
+        g.intimidated_today = c.boss_intimidate
+    else:
+        g.intimidated_today = None
+
+    return {
+        "message": f"Ночь {g.night}: {killed_text}. Наступает день {g.day}",
+        "stage": g.stage,
+        "game_ended": False,
+        "deaths": killed_names,
+        "summary": summary,
+        "is_mourning": g.skip_vote_day == g.day,
+        "intimidated": g.intimidated_today,
+    }
+
+
+@command
+def undo(g: Game) -> dict:
+    """Undo last action"""
+    if not g.pop_undo():
+        raise GameError("Нечего отменять")
+
+    return {"message": "Отменено", "stage": g.stage}
@@ -0,0 +1,138 @@
+"""Prometheus metrics in the text exposition format, without a client library.
+
+MetricsMiddleware times every HTTP request and counts it per route (the name
+of the endpoint function: night_action, get_game_state, ...) and status code.
+It runs on the event loop, so the counters need no lock; a request costs a
+perf_counter pair, a bisect and a few dict updates.
+
+Game gauges (games per stage, undo stack depth and size, log lines) are not
+tracked on the hot path at all: game_samples() computes them from the loaded
+games when /metrics is scraped.
+"""
+import sys
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple
+
+from engine import Game, Stage
+
+# Upper bounds of the latency histogram buckets, seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Requests that matched no route share one label instead of one per path
+UNMATCHED = "unmatched"
+
+
+class RouteStats:
+    __slots__ = ("buckets", "total", "statuses")
+
+    def __init__(self, size: int):
+        self.buckets = [0] * size  # per bucket, not cumulative; the last one is +Inf
+        self.total = 0.0
+        self.statuses: Dict[int, int] = {}
+
+
+class RequestMetrics:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.routes: Dict[str, RouteStats] = {}
+
+    def observe(self, route: str, status: int, seconds: float):
+        stats = self.routes.get(route)
+        if stats is None:
+            stats = self.routes[route] = RouteStats(len(self.buckets) + 1)
+        stats.buckets[bisect_left(self.buckets, seconds)] += 1
+        stats.total += seconds
+        stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+    def samples(self) -> List[str]:
+        lines = [
+            "# HELP mafia_http_requests_total HTTP requests by route and status code",
+            "# TYPE mafia_http_requests_total counter",
+        ]
+        for route, stats in sorted(self.routes.items()):
+            for status, count in sorted(stats.statuses.items()):
+                lines.append(f'mafia_http_requests_total{{route="{route}",status="{status}"}} {count}')
+        lines += [
+            "# HELP mafia_http_request_duration_seconds HTTP request latency by route",
+            "# TYPE mafia_http_request_duration_seconds histogram",
+        ]
+        for route, stats in sorted(self.routes.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), stats.buckets):
+                cumulative += count
+                lines.append(f'mafia_http_request_duration_seconds_bucket{{route="{route}",le="{bound}"}} {cumulative}')
+            lines.append(f'mafia_http_request_duration_seconds_sum{{route="{route}"}} {stats.total}')
+            lines.append(f'mafia_http_request_duration_seconds_count{{route="{route}"}} {cumulative}')
+        return lines
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware feeding RequestMetrics; WebSocket traffic passes through"""
+
+    def __init__(self, app, metrics: RequestMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            # The router stores the matched endpoint in the shared scope
+            endpoint = scope.get("endpoint")
+            route = getattr(endpoint, "__name__", UNMATCHED) if endpoint is not None else UNMATCHED
+            self.metrics.observe(route, status, time.perf_counter() - start)
+
+
+def undo_entry_bytes(entry) -> int:
+    """Rough size of an undo entry: the entry, its journal and the journal tuples.
+
+    Strings are interned and shared with the game, so they are not counted.
+    """
+    return sys.getsizeof(entry) + sys.getsizeof(entry.changes) + sum(map(sys.getsizeof, entry.changes))
+
+
+def gauge(name: str, help_text: str, value) -> List[str]:
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+
+def counter(name: str, help_text: str, values: Dict[str, int], label: str) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+    lines += [f'{name}{{{label}="{key}"}} {value}' for key, value in values.items()]
+    return lines
+
+
+def game_samples(games: Iterable[Game]) -> List[str]:
+    """Gauges over the games held in memory"""
+    stages = {stage.value: 0 for stage in Stage}
+    undo_entries = undo_bytes = log_lines = 0
+    for g in games:
+        stages[g.stage] += 1
+        # Copy first: the game may be changed by a request running in the threadpool
+        entries = list(g.undo_stack)
+        undo_entries += len(entries)
+        undo_bytes += sum(map(undo_entry_bytes, entries))
+        log_lines += len(g.log_lines)
+
+    lines = ["# HELP mafia_games Games held in memory by stage", "# TYPE mafia_games gauge"]
+    lines += [f'mafia_games{{stage="{stage}"}} {count}' for stage, count in stages.items()]
+    lines += gauge("mafia_undo_entries", "Undo checkpoints over all games", undo_entries)
+    lines += gauge("mafia_undo_bytes", "Approximate memory of all undo stacks", undo_bytes)
+    lines += gauge("mafia_log_lines", "Game log lines held over all games", log_lines)
+    return lines
+
+
+def render(*sections: List[str]) -> str:
+    return "\n".join(line for section in sections for line in section) + "\n"
@@ -0,0 +1,115 @@
+"""Resolve night kills of many games at once with NumPy.
+
+Vectorized counterpart of engine.apply_night_and_get_deaths for balance
+analysis. N games are passed as arrays: players are columns (padded with dead
+role-less players), roles are codes into ROLE_CODES, and every night choice
+is a player column or -1 for none. resolve_nights() applies the monk
+redirect, courtesan and doctor saves, immortality and the courtesan's client
+dying with her, and returns an N x P death mask. Summary lines are not built.
+
+NumPy is optional and only needed by this module (pip install numpy).
+"""
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple
+
+import engine
+from engine import Game
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# role code -> role; 0 is a player without a role
+ROLE_CODES = [None] + engine.ALL_ROLES_ORDER + [engine.ROLE_RAT_MAFIA]
+CODE_OF = {role: code for code, role in enumerate(ROLE_CODES)}
+
+CHOICES = ("mafia_target", "maniac_target", "monk_first", "monk_second", "doctor_target", "courtesan_client")
+
+
+@dataclass
+class NightBatch:
+    alive: "np.ndarray"  # bool, N x P
+    roles: "np.ndarray"  # int8 role codes, N x P
+    # int32 player column per game, -1 = not chosen
+    mafia_target: "np.ndarray"
+    maniac_target: "np.ndarray"
+    monk_first: "np.ndarray"
+    monk_second: "np.ndarray"
+    doctor_target: "np.ndarray"
+    courtesan_client: "np.ndarray"
+
+    def __len__(self) -> int:
+        return len(self.alive)
+
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError("night_batch needs NumPy: pip install numpy")
+
+
+def encode_games(games: Sequence[Game]) -> Tuple[NightBatch, List[List[str]]]:
+    """Pack the current night of each game; also returns player names per column"""
+    require_numpy()
+    width = max((len(g.players) for g in games), default=0)
+    alive = np.zeros((len(games), width), dtype=bool)
+    roles = np.zeros((len(games), width), dtype=np.int8)
+    choices = {name: np.full(len(games), -1, dtype=np.int32) for name in CHOICES}
+    names = []
+    for i, g in enumerate(games):
+        column = {}
+        for j, p in enumerate(g.players.values()):
+            column[p.name] = j
+            alive[i, j] = p.alive
+            roles[i, j] = CODE_OF[p.role]
+        for name in CHOICES:
+            choices[name][i] = column.get(getattr(g.night_choices, name), -1)
+        names.append(list(g.players))
+    return NightBatch(alive=alive, roles=roles, **choices), names
+
+
+def decode_deaths(deaths: "np.ndarray", names: List[List[str]]) -> List[List[str]]:
+    """Death mask -> sorted names per game, like apply_night_and_get_deaths"""
+    return [sorted(names[i][j] for j in np.flatnonzero(row)) for i, row in enumerate(deaths)]
+
+
+def resolve_nights(b: NightBatch) -> "np.ndarray":
+    """Death mask (N x P bool) of the night described by each game of the batch"""
+    require_numpy()
+    n = len(b)
+    rows = np.arange(n)
+    alive = b.alive
+
+    def alive_at(col):
+        return (col >= 0) & alive[rows, np.maximum(col, 0)]
+
+    def role_alive(role: str):
+        return (alive & (b.roles == CODE_OF[role])).any(axis=1)
+
+    immortal = alive & (b.roles == CODE_OF[engine.ROLE_IMMORTAL])
+    courtesans = alive & (b.roles == CODE_OF[engine.ROLE_COURTESAN])
+    courtesan_alive = courtesans.any(axis=1)
+    # get_role_owner: the first alive courtesan in player order
+    courtesan = np.where(courtesan_alive, courtesans.argmax(axis=1), -1)
+
+    client = np.where(courtesan_alive & alive_at(b.courtesan_client), b.courtesan_client, -1)
+    doctor = np.where(role_alive(engine.ROLE_DOCTOR) & alive_at(b.doctor_target), b.doctor_target, -1)
+    mafia = np.where(alive_at(b.mafia_target), b.mafia_target, -1)
+    maniac = np.where(role_alive(engine.ROLE_MANIAC) & alive_at(b.maniac_target), b.maniac_target, -1)
+
+    # Monk: a kill aimed at the first player goes to the second one
+    monk_active = role_alive(engine.ROLE_MONK) & alive_at(b.monk_first) & alive_at(b.monk_second)
+    mafia = np.where(monk_active & (mafia >= 0) & (mafia == b.monk_first), b.monk_second, mafia)
+    maniac = np.where(monk_active & (maniac >= 0) & (maniac == b.monk_first), b.monk_second, maniac)
+
+    client_col = np.maximum(client, 0)
+    client_can_die = (client >= 0) & ~immortal[rows, client_col]
+    deaths = np.zeros_like(alive)
+    for target in (mafia, maniac):
+        col = np.maximum(target, 0)
+        # Same checks as kill_logic: immortal, then the courtesan's client, then the doctor
+        dies = alive_at(target) & ~immortal[rows, col] & (client != target) & (doctor != target)
+        deaths[rows, col] |= dies
+        # A killed courtesan takes her client with her
+        deaths[rows, client_col] |= dies & (target == courtesan) & client_can_die
+    return deaths
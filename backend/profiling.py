@@ -0,0 +1,173 @@
+"""On-demand cProfile of HTTP requests.
+
+Off unless configured, and then nothing is installed at all:
+- MAFIA_PROFILE_SAMPLE: fraction of requests to profile (e.g. 0.01)
+- MAFIA_PROFILE_ROUTES: endpoint names profiled on every call
+  (e.g. "finish_night,get_game_state")
+- MAFIA_PROFILE_TOKEN: a request with the header `X-Profile: <token>` is profiled
+- MAFIA_PROFILE_DIR: where .prof dumps go (default backend/profiles), open them
+  with `python -m pstats` or snakeviz
+- MAFIA_PROFILE_KEEP: how many recent profiles (and dumps) to keep, default 100
+
+Sync endpoints run in the threadpool, and cProfile only sees the thread that
+enabled it, so the profiler is switched on around the endpoint function
+itself (install() wraps every route's call); the middleware measures the
+whole request and writes the dump. One request is profiled at a time: on
+Python 3.12+ cProfile is process-wide, and a second one would fail.
+"""
+import cProfile
+import functools
+import hmac
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, List, Optional, Set
+
+from fastapi import FastAPI
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+
+TOP_FUNCTIONS = 10
+
+
+class ProfiledRequest:
+    __slots__ = ("forced", "route", "profile")
+
+    def __init__(self, forced: bool):
+        self.forced = forced
+        self.route: Optional[str] = None
+        self.profile: Optional[cProfile.Profile] = None
+
+
+CURRENT: ContextVar[Optional[ProfiledRequest]] = ContextVar("profiled_request", default=None)
+
+
+def top_functions(profile: cProfile.Profile, limit: int = TOP_FUNCTIONS) -> List[dict]:
+    """Functions with the most own time: "file:line(name)", calls, own and cumulative ms"""
+    stats = pstats.Stats(profile).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+    return [
+        {
+            "function": f"{os.path.basename(file)}:{line}({name})",
+            "calls": calls,
+            "own_ms": round(own * 1000, 3),
+            "cumulative_ms": round(cumulative * 1000, 3),
+        }
+        for (file, line, name), (_, calls, own, cumulative, _) in rows
+    ]
+
+
+class Profiler:
+    def __init__(self, sample: float = 0.0, routes: Optional[Set[str]] = None, token: Optional[str] = None,
+                 directory: str = "profiles", keep: int = 100):
+        self.sample = sample
+        self.routes = routes or set()
+        self.token = token.encode() if token else None
+        self.directory = directory
+        self.recent: Deque[dict] = deque()
+        self.keep = keep
+        self._busy = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["Profiler"]:
+        sample = float(os.environ.get("MAFIA_PROFILE_SAMPLE", 0))
+        routes = {r.strip() for r in os.environ.get("MAFIA_PROFILE_ROUTES", "").split(",") if r.strip()}
+        token = os.environ.get("MAFIA_PROFILE_TOKEN") or None
+        if not (sample or routes or token):
+            return None
+        directory = os.environ.get("MAFIA_PROFILE_DIR", os.path.join(os.path.dirname(__file__), "profiles"))
+        return cls(sample, routes, token, directory, int(os.environ.get("MAFIA_PROFILE_KEEP", 100)))
+
+    def install(self, app: FastAPI):
+        """Wrap route calls and add the middleware; call after all routes are declared"""
+        for route in app.routes:
+            if isinstance(route, APIRoute) and route.dependant.call is not None:
+                route.dependant.call = self._wrap(route.dependant.call, route.name)
+        app.add_middleware(ProfilingMiddleware, profiler=self)
+
+    def _wrap(self, call, name: str):
+        @functools.wraps(call)
+        def wrapper(*args, **kwargs):
+            req = CURRENT.get()
+            if req is None or not (req.forced or name in self.routes) or not self._busy.acquire(blocking=False):
+                return call(*args, **kwargs)
+            req.route = name
+            req.profile = cProfile.Profile()
+            try:
+                req.profile.enable()
+                try:
+                    return call(*args, **kwargs)
+                finally:
+                    req.profile.disable()
+            finally:
+                self._busy.release()
+
+        return wrapper
+
+    def wanted(self, headers) -> bool:
+        if self.sample and random.random() < self.sample:
+            return True
+        if self.token is not None:
+            for key, value in headers:
+                if key == b"x-profile":
+                    return hmac.compare_digest(value, self.token)
+        return False
+
+    def record(self, req: ProfiledRequest, method: str, path: str, status: int, seconds: float):
+        """Dump the profile and remember the request (runs in the threadpool)"""
+        os.makedirs(self.directory, exist_ok=True)
+        started = time.time()
+        dump = os.path.join(self.directory, f"{int(started * 1000)}-{req.route}-{seconds * 1000:.0f}ms.prof")
+        req.profile.dump_stats(dump)
+        self.recent.append({
+            "route": req.route,
+            "method": method,
+            "path": path,
+            "status": status,
+            "duration_ms": round(seconds * 1000, 3),
+            "at": started,
+            "dump": dump,
+            "top": top_functions(req.profile),
+        })
+        while len(self.recent) > self.keep:
+            old = self.recent.popleft()
+            try:
+                os.remove(old["dump"])
+            except OSError:
+                pass
+
+    def slowest(self, limit: int) -> List[dict]:
+        return sorted(self.recent, key=lambda r: r["duration_ms"], reverse=True)[:limit]
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        req = ProfiledRequest(self.profiler.wanted(scope["headers"]))
+        token = CURRENT.set(req)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            CURRENT.reset(token)
+            if req.profile is not None:
+                await run_in_threadpool(self.profiler.record, req, scope["method"], scope["path"], status,
+                                        time.perf_counter() - start)
@@ -0,0 +1,157 @@
+"""Push game state to WebSocket clients.
+
+GameHub keeps the connected sockets of every game. notify(game_id) may be
+called from any thread (sync endpoints run in the threadpool); it schedules
+one broadcast on the event loop, and several notifications that arrive
+before it renders are coalesced into one. The message is rendered once per
+broadcast in a worker thread, since rendering may wait for a state being
+encoded or read the store, and then handed to every subscriber on the loop.
+Notifications that arrive while it renders make it render once more.
+
+With several worker processes a game may change in another worker, whose
+notify() does not reach the sockets held here. watch() polls the store for
+such changes to the games that have subscribers and notifies them.
+
+Each subscriber has its own sender task, which sends queued command replies
+first and then only the latest state. Slow clients skip states they had no
+time to receive and never hold up the others.
+"""
+import asyncio
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set
+
+from starlette.concurrency import run_in_threadpool
+from starlette.websockets import WebSocket
+
+
+class Subscriber:
+    def __init__(self, ws: WebSocket):
+        self.ws = ws
+        self.replies: Deque[str] = deque()
+        self.state: Optional[str] = None
+        self._ready = asyncio.Event()
+
+    def offer_state(self, message: str):
+        self.state = message
+        self._ready.set()
+
+    def offer_reply(self, message: str):
+        self.replies.append(message)
+        self._ready.set()
+
+    async def run(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self.replies:
+                    await self.ws.send_text(self.replies.popleft())
+                if self.state is not None:
+                    message, self.state = self.state, None
+                    await self.ws.send_text(message)
+        except Exception:
+            # Connection is gone; the receive loop unsubscribes us
+            return
+
+
+class GameHub:
+    def __init__(self, render: Callable[[str], str]):
+        """render(game_id) builds the text pushed to subscribers of the game; it runs in a worker thread"""
+        self._render = render
+        self._subscribers: Dict[str, Set[Subscriber]] = {}
+        # Games with a broadcast scheduled or running, and those changed since it started rendering
+        self._scheduled: Set[str] = set()
+        self._stale: Set[str] = set()
+        self._guard = threading.Lock()
+        self._tasks: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._watcher: Optional[asyncio.Task] = None
+
+    async def subscribe(self, game_id: str, ws: WebSocket) -> Subscriber:
+        self._loop = asyncio.get_running_loop()
+        sub = Subscriber(ws)
+        self._subscribers.setdefault(game_id, set()).add(sub)
+        message = await run_in_threadpool(self._render, game_id)
+        # A broadcast that got here first is as new: changes after it started rendering broadcast again
+        if sub.state is None:
+            sub.offer_state(message)
+        return sub
+
+    def unsubscribe(self, game_id: str, sub: Subscriber):
+        subs = self._subscribers.get(game_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subscribers[game_id]
+
+    def subscriber_count(self, game_id: Optional[str] = None) -> int:
+        if game_id is not None:
+            return len(self._subscribers.get(game_id, ()))
+        return sum(len(subs) for subs in self._subscribers.values())
+
+    def notify(self, game_id: str):
+        """Game changed: push it to subscribers. Free when nobody watches"""
+        if game_id not in self._subscribers or self._loop is None:
+            return
+        with self._guard:
+            if game_id in self._scheduled:
+                self._stale.add(game_id)
+                return
+            self._scheduled.add(game_id)
+        self._loop.call_soon_threadsafe(self._start_broadcast, game_id)
+
+    def watch(self, changed: Callable[[List[str]], List[str]], interval: float):
+        """Every `interval` seconds notify the subscribed games that changed(game_ids) reports.
+
+        changed runs in a worker thread. Call from the event loop, e.g. in the app lifespan.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._watcher = asyncio.ensure_future(self._watch(changed, interval))
+
+    async def stop_watching(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    async def _watch(self, changed: Callable[[List[str]], List[str]], interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            game_ids = list(self._subscribers)
+            if not game_ids:
+                continue
+            try:
+                for game_id in await run_in_threadpool(changed, game_ids):
+                    self.notify(game_id)
+            except Exception as e:
+                print(f"[ws] looking for changes from other workers failed: {e}")
+
+    def _start_broadcast(self, game_id: str):
+        task = asyncio.ensure_future(self._broadcast(game_id))
+        # The loop keeps only weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _broadcast(self, game_id: str):
+        again = True
+        while again:
+            with self._guard:
+                self._stale.discard(game_id)
+            message = None
+            try:
+                if self._subscribers.get(game_id):
+                    message = await run_in_threadpool(self._render, game_id)
+            finally:
+                with self._guard:
+                    # Changed while it rendered: go again, notify() only marked it stale
+                    again = message is not None and game_id in self._stale
+                    if not again:
+                        self._scheduled.discard(game_id)
+            if message is not None:
+                # Whoever subscribed while it rendered gets it too
+                for sub in self._subscribers.get(game_id, ()):
+                    sub.offer_state(message)
@@ -0,0 +1,234 @@
+"""Monte Carlo simulator: plays many games with the rules engine and reports win rates.
+
+Every game is played start to finish through engine.py, the same functions
+the HTTP endpoints call, so results follow the production rules. Games are
+spread over a process pool.
+
+    python -m simulate --players 10 --games 100000
+    python -m simulate --roles "Мафия=2,Комиссар=1" --roles "Мафия=2,Маньяк=1" --strategy commissioner
+    python -m simulate --games 1000000 --workers 8 --json
+
+--roles overrides counts of the default composition (Босс мафии, Доктор,
+Куртизанка and one Мафия); civilians fill the remaining seats.
+
+Strategies:
+- random: every choice is uniform among the allowed targets
+- commissioner: the town votes out players the commissioner found to be
+  mafia and never votes those found clean; everything else is random
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Set
+
+import engine
+from engine import Game, Stage
+
+# Stop a game that keeps going; the rules always kill someone by day, so it is not expected
+MAX_ACTIONS = 2000
+
+OUTCOMES = ("mafia", "peace", "draw", "unfinished")
+
+
+class RandomStrategy:
+    def __init__(self, rnd: random.Random):
+        self.rnd = rnd
+
+    def new_game(self, g: Game):
+        pass
+
+    def vote(self, g: Game, candidates: List[str]) -> str:
+        return self.rnd.choice(candidates)
+
+    def revenge(self, g: Game, candidates: List[str]) -> str:
+        return self.rnd.choice(candidates)
+
+    def night_target(self, g: Game, step: str, targets: List[str]) -> str:
+        target = self.rnd.choice(targets)
+        self.observe(g, step, target)
+        return target
+
+    def yesno(self, g: Game, step: str) -> bool:
+        return self.rnd.random() < 0.5
+
+    def observe(self, g: Game, step: str, target: str):
+        pass
+
+
+class CommissionerStrategy(RandomStrategy):
+    """The town acts on the commissioner's checks"""
+
+    def new_game(self, g: Game):
+        self.suspects: Set[str] = set()
+        self.cleared: Set[str] = set()
+
+    def vote(self, g: Game, candidates: List[str]) -> str:
+        suspects = [n for n in candidates if n in self.suspects]
+        if suspects:
+            return self.rnd.choice(suspects)
+        unknown = [n for n in candidates if n not in self.cleared]
+        return self.rnd.choice(unknown or candidates)
+
+    def observe(self, g: Game, step: str, target: str):
+        if step == "commissioner_check":
+            mafia = engine.commissioner_answer_for(g, target).startswith("ДА")
+            (self.suspects if mafia else self.cleared).add(target)
+
+
+STRATEGIES = {"random": RandomStrategy, "commissioner": CommissionerStrategy}
+
+
+def parse_roles(spec: str, players: int) -> Dict[str, int]:
+    """"Мафия=2,Комиссар=1" -> full role counts: the default composition, overrides, civilians"""
+    g = Game(game_id="", host_id=0)
+    engine.init_default_roles(g)
+    counts = dict(g.role_counts)
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        role, _, count = item.partition("=")
+        counts[role.strip()] = int(count or 1)
+    counts[engine.ROLE_CIVIL] = players - sum(c for r, c in counts.items() if r != engine.ROLE_CIVIL)
+    return {role: count for role, count in counts.items() if count}
+
+
+def setup_game(roles: Dict[str, int], players: int, rnd: random.Random) -> Game:
+    g = Game(game_id="sim", host_id=0)
+    # Simulated games are never rebuilt: skip the event history
+    g.history = False
+    engine.init_default_roles(g)
+    for i in range(players):
+        engine.add_player(g, f"Игрок {i + 1}")
+    for role, count in roles.items():
+        engine.set_role_count(g, role, count)
+    engine.start_game(g)
+
+    for role in engine.BIND_ROLES_ORDER + [r for r in g.bind_remaining if r not in engine.BIND_ROLES_ORDER]:
+        for _ in range(g.bind_remaining.get(role, 0)):
+            engine.bind_role(g, role)
+            engine.bind_player(g, rnd.choice(g.bind_available_players))
+    mayor, successor = rnd.sample(list(g.players), 2)
+    engine.select_mayor(g, mayor)
+    engine.select_successor(g, successor)
+    return g
+
+
+def play_game(roles: Dict[str, int], players: int, strategy: RandomStrategy, rnd: random.Random) -> str:
+    """Play one game to the end, returns one of OUTCOMES"""
+    g = setup_game(roles, players, rnd)
+    strategy.new_game(g)
+    for _ in range(MAX_ACTIONS):
+        if g.stage == Stage.END:
+            result = engine.check_end(g) or ""
+            if result.startswith("Победа мафии"):
+                return "mafia"
+            if result.startswith("Победа мирных"):
+                return "peace"
+            return "draw"
+        if g.stage == Stage.DAY_MENU:
+            if g.skip_vote_day == g.day:
+                engine.skip_to_night(g)
+            else:
+                engine.day_vote_start(g)
+        elif g.stage == Stage.DAY_VOTE_PICK:
+            candidates = [n for n in g.alive_names() if g.protected_from_vote_day.get(n) != g.day]
+            engine.day_vote(g, strategy.vote(g, candidates))
+        elif g.stage == Stage.AVENGER_REVENGE_PICK:
+            candidates = [n for n in g.alive_names() if n != g.avenger_pending]
+            engine.avenger_revenge(g, strategy.revenge(g, candidates))
+        elif g.stage == Stage.NIGHT_MENU:
+            if g.night_step_index >= len(g.night_steps):
+                engine.finish_night(g)
+                continue
+            step = g.night_steps[g.night_step_index]
+            if step in engine.YESNO_STEPS:
+                engine.night_action(g, choice=strategy.yesno(g, step))
+            else:
+                targets = engine.cached_step_targets(g, step) or g.alive_names()
+                engine.night_action(g, target=strategy.night_target(g, step, targets))
+        else:
+            raise RuntimeError(f"Unexpected stage {g.stage}")
+    return "unfinished"
+
+
+def run_chunk(task) -> Dict[str, Counter]:
+    """Worker: play `games` games of every composition with its own seed"""
+    compositions, players, games, strategy_name, seed = task
+    rnd = random.Random(seed)
+    strategy = STRATEGIES[strategy_name](rnd)
+    results = {}
+    for name, roles in compositions.items():
+        outcomes = Counter()
+        for _ in range(games):
+            outcomes[play_game(roles, players, strategy, rnd)] += 1
+        results[name] = outcomes
+    return results
+
+
+def simulate(compositions: Dict[str, Dict[str, int]], players: int, games: int, strategy: str = "random",
+             workers: Optional[int] = None, seed: int = 0, chunk: int = 1000) -> Dict[str, Counter]:
+    tasks = []
+    left = games
+    while left > 0:
+        n = min(chunk, left)
+        tasks.append((compositions, players, n, strategy, seed * 1_000_003 + len(tasks)))
+        left -= n
+
+    if workers == 1:
+        parts = [run_chunk(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            parts = list(pool.imap_unordered(run_chunk, tasks))
+
+    totals = {name: Counter() for name in compositions}
+    for part in parts:
+        for name, outcomes in part.items():
+            totals[name].update(outcomes)
+    return totals
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=10)
+    parser.add_argument("--games", type=int, default=10000, help="games per composition")
+    parser.add_argument("--roles", action="append", default=[], help='e.g. "Мафия=2,Комиссар=1"; repeatable')
+    parser.add_argument("--strategy", choices=sorted(STRATEGIES), default="random")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    compositions = {spec or "по умолчанию": parse_roles(spec, args.players) for spec in args.roles or [""]}
+    for name, roles in compositions.items():
+        try:
+            setup_game(roles, args.players, random.Random(0))
+        except engine.GameError as e:
+            parser.error(f"{name}: {e.detail}")
+    start = time.perf_counter()
+    totals = simulate(compositions, args.players, args.games, args.strategy, args.workers, args.seed)
+    elapsed = time.perf_counter() - start
+
+    rows = []
+    for name, outcomes in totals.items():
+        played = sum(outcomes.values())
+        rows.append({
+            "roles": name,
+            "composition": compositions[name],
+            "games": played,
+            **{f"{outcome}_rate": outcomes[outcome] / played for outcome in OUTCOMES},
+        })
+    if args.json:
+        print(json.dumps({"players": args.players, "strategy": args.strategy, "seconds": elapsed,
+                          "results": rows}, ensure_ascii=False, indent=2))
+        return
+    print(f"{args.players} игроков, стратегия {args.strategy}, {elapsed:.1f} с")
+    print(f"{'роли':<40} {'игр':>9} {'мафия':>7} {'мирные':>7} {'ничья':>7}")
+    for row in rows:
+        print(f"{row['roles']:<40} {row['games']:>9} {row['mafia_rate']:>7.1%} "
+              f"{row['peace_rate']:>7.1%} {row['draw_rate']:>7.1%}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,979 @@
+"""Game storage backends.
+
+main.py reads and writes games only through a GameStore:
+- MemoryGameStore keeps games in a process-local dict (default)
+- SqliteGameStore also persists them to SQLite (WAL) so they survive restarts
+- SharedSqliteGameStore lets several worker processes serve the same games
+
+Stored objects must have `game_id` and an integer `version` attribute.
+Given a History, the SQLite stores keep a game's append-only history in
+tables of their own and only append what is new, instead of rewriting it
+inside the game row on every save.
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Generic, Iterable, Iterator, List, Optional, Set, Tuple, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Rows read per query when scanning all games
+SCAN_PAGE = 500
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS games ("
+    " game_id TEXT PRIMARY KEY,"
+    " version INTEGER NOT NULL DEFAULT 0,"
+    " data TEXT NOT NULL,"
+    " updated_at REAL NOT NULL)"
+)
+
+HISTORY_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS game_events ("
+    " game_id TEXT NOT NULL,"
+    " seq INTEGER NOT NULL,"
+    " data BLOB NOT NULL,"
+    " PRIMARY KEY (game_id, seq)) WITHOUT ROWID",
+    # `events` is how many events the game had when the snapshot was taken
+    "CREATE TABLE IF NOT EXISTS game_snapshots ("
+    " game_id TEXT NOT NULL,"
+    " seq INTEGER NOT NULL,"
+    " events INTEGER NOT NULL,"
+    " data BLOB NOT NULL,"
+    " PRIMARY KEY (game_id, seq)) WITHOUT ROWID",
+)
+
+
+class StoreConflict(Exception):
+    """The game kept changing in another process, mutation was not applied"""
+
+
+class KeyedLocks:
+    """One reentrant lock per key, created on first use and dropped when nobody holds or waits for it"""
+
+    def __init__(self):
+        self._locks: Dict[str, list] = {}  # key -> [RLock, holders and waiters]
+        self._guard = threading.Lock()
+
+    @contextmanager
+    def hold(self, key: str, blocking: bool = True):
+        """Yields whether the lock was taken, always True when blocking"""
+        with self._guard:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.RLock(), 0]
+            entry[1] += 1
+        acquired = False
+        try:
+            acquired = entry[0].acquire(blocking)
+            yield acquired
+        finally:
+            if acquired:
+                entry[0].release()
+            with self._guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    def busy(self, key: str) -> bool:
+        return key in self._locks
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class History(Generic[T]):
+    """Access to the append-only history of a game: encoded events and (event count, data) snapshots"""
+
+    def events(self, game: T, start: int) -> List[bytes]:
+        raise NotImplementedError
+
+    def snapshots(self, game: T, start: int) -> List[Tuple[int, bytes]]:
+        raise NotImplementedError
+
+    def attach(self, game: T, events: List[bytes], snapshots: List[Tuple[int, bytes]]) -> None:
+        """Give a game decoded from its row the history stored for it"""
+        raise NotImplementedError
+
+
+def create_history(db: sqlite3.Connection) -> None:
+    for statement in HISTORY_SCHEMA:
+        db.execute(statement)
+
+
+def history_rows(db: sqlite3.Connection, game_id: str) -> Tuple[List[bytes], List[Tuple[int, bytes]]]:
+    events = [row[0] for row in db.execute(
+        "SELECT data FROM game_events WHERE game_id = ? ORDER BY seq", (game_id,))]
+    snapshots = db.execute(
+        "SELECT events, data FROM game_snapshots WHERE game_id = ? ORDER BY seq", (game_id,)
+    ).fetchall()
+    return events, snapshots
+
+
+def attach_history(history: History[T], game: T, rows: Tuple[List[bytes], List[Tuple[int, bytes]]]) -> Tuple[int, int]:
+    """Give a game its history_rows(); returns how many events and snapshots are saved"""
+    events, snapshots = rows
+    if not events and not snapshots:
+        # Nothing saved yet, or a row from before the history tables: whatever
+        # history the row held is written out on the next save
+        return 0, 0
+    history.attach(game, events, snapshots)
+    return len(events), len(snapshots)
+
+
+def delete_history(db: sqlite3.Connection, game_ids: List[str]) -> None:
+    for table in ("game_events", "game_snapshots"):
+        db.executemany(f"DELETE FROM {table} WHERE game_id = ?", [(gid,) for gid in game_ids])
+
+
+def write_history(db: sqlite3.Connection, history: History[T], game: T, saved: Tuple[int, int]) -> Tuple[int, int]:
+    """Append the events and snapshots after `saved`; returns the new saved counts"""
+    events = history.events(game, saved[0])
+    snapshots = history.snapshots(game, saved[1])
+    db.executemany(
+        "INSERT OR REPLACE INTO game_events (game_id, seq, data) VALUES (?, ?, ?)",
+        [(game.game_id, saved[0] + i, data) for i, data in enumerate(events)],
+    )
+    db.executemany(
+        "INSERT OR REPLACE INTO game_snapshots (game_id, seq, events, data) VALUES (?, ?, ?, ?)",
+        [(game.game_id, saved[1] + i, count, data) for i, (count, data) in enumerate(snapshots)],
+    )
+    return saved[0] + len(events), saved[1] + len(snapshots)
+
+
+def advance_version(game: T, current: Optional[int]) -> None:
+    """Give a game that replaces a stored one (reset, import with overwrite) a newer version.
+
+    An imported game carries the version it was exported at, which may be
+    older than the stored one; reusing it would make stale ETags match again.
+    """
+    if current is not None:
+        game.version = max(game.version, current + 1)
+
+
+def connect(path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    # With WAL, synchronous=NORMAL stays consistent; an OS crash may only lose the last commits
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("PRAGMA busy_timeout=5000")
+    return db
+
+
+class GameStore(Generic[T]):
+    """Storage interface.
+
+    The base class also tracks when each game held in memory was last used.
+    Games idle for longer than `ttl` seconds are unloaded by evict_idle(),
+    which the reaper thread calls periodically. No more than `max_games` are
+    kept: over the cap the least recently used game is unloaded, and games
+    with eviction_priority 0 (ended or never started) go first. The memory
+    store loses unloaded games; the SQLite stores only drop them from the
+    cache and reload them on the next access.
+    """
+
+    def __init__(
+        self,
+        ttl: Optional[float] = None,
+        max_games: Optional[int] = None,
+        eviction_priority: Optional[Callable[[T], int]] = None,
+    ):
+        self.ttl = ttl
+        self.max_games = max_games
+        self._priority = eviction_priority or (lambda g: 1)
+        # LRU order per priority (0 = evict first), oldest first: game_id -> last access
+        self._lru: Tuple["OrderedDict[str, float]", "OrderedDict[str, float]"] = (OrderedDict(), OrderedDict())
+        self._lru_lock = threading.Lock()
+        self.evicted_idle = 0
+        self.evicted_cap = 0
+        self._reaper: Optional[threading.Thread] = None
+        self._reaper_stop = threading.Event()
+        self._game_locks = KeyedLocks()
+
+    def get(self, game_id: str) -> Optional[T]:
+        raise NotImplementedError
+
+    def locked(self, game_id: str, blocking: bool = True):
+        """Context manager serializing changes to one game; other games are not blocked.
+
+        With blocking=False it does not wait for a busy game and yields False instead.
+        """
+        return self._game_locks.hold(game_id, blocking)
+
+    # ---- eviction ----
+    def touch(self, game: T) -> None:
+        """Record an access; also re-ranks the game if its priority changed"""
+        prio = 0 if self._priority(game) == 0 else 1
+        with self._lru_lock:
+            self._lru[1 - prio].pop(game.game_id, None)
+            lru = self._lru[prio]
+            lru[game.game_id] = time.monotonic()
+            lru.move_to_end(game.game_id)
+
+    def forget(self, game_id: str) -> None:
+        with self._lru_lock:
+            for lru in self._lru:
+                lru.pop(game_id, None)
+
+    def idle_for(self, game_id: str) -> Optional[float]:
+        """Seconds since the game was last used, None if it is not held in memory"""
+        with self._lru_lock:
+            for lru in self._lru:
+                last_access = lru.get(game_id)
+                if last_access is not None:
+                    return time.monotonic() - last_access
+        return None
+
+    def _unload(self, game_id: str) -> None:
+        """Drop an evicted game from memory"""
+        raise NotImplementedError
+
+    def evict_idle(self) -> int:
+        if not self.ttl:
+            return 0
+        deadline = time.monotonic() - self.ttl
+        victims = []
+        with self._lru_lock:
+            for lru in self._lru:
+                while lru:
+                    game_id, last_access = next(iter(lru.items()))
+                    if last_access >= deadline:
+                        break
+                    lru.popitem(last=False)
+                    victims.append(game_id)
+        evicted = 0
+        for game_id in victims:
+            # A game being changed right now stays: the mutation touches it again when it saves
+            if self._game_locks.busy(game_id):
+                continue
+            with self.locked(game_id):
+                # Checked again under the lock: a request may have used the game since it was picked
+                if self.idle_for(game_id) is not None:
+                    continue
+                self._unload(game_id)
+            evicted += 1
+        self.evicted_idle += evicted
+        return evicted
+
+    def enforce_cap(self, keep: Optional[str] = None) -> int:
+        """Unload least recently used games over max_games, never `keep`"""
+        if not self.max_games:
+            return 0
+        victims = []
+        with self._lru_lock:
+            while len(self._lru[0]) + len(self._lru[1]) > self.max_games:
+                victim = next((gid for lru in self._lru for gid in lru
+                               if gid != keep and not self._game_locks.busy(gid)), None)
+                if victim is None:
+                    break
+                for lru in self._lru:
+                    lru.pop(victim, None)
+                victims.append(victim)
+        evicted = 0
+        for game_id in victims:
+            # The caller may hold the lock of another game: waiting here could deadlock with a
+            # request that holds this one and caps too, so a game that became busy is skipped
+            with self.locked(game_id, blocking=False) as acquired:
+                # Checked again under the lock: a request may have used the game since it was picked
+                if not acquired or self.idle_for(game_id) is not None:
+                    continue
+                self._unload(game_id)
+            evicted += 1
+        self.evicted_cap += evicted
+        return evicted
+
+    def start_reaper(self, interval: float = 60.0) -> None:
+        def loop():
+            while not self._reaper_stop.wait(interval):
+                try:
+                    self.evict_idle()
+                except Exception as e:
+                    print(f"[store] eviction failed: {e}")
+
+        self._reaper = threading.Thread(target=loop, name="game-store-reaper", daemon=True)
+        self._reaper.start()
+
+    def stop_reaper(self) -> None:
+        self._reaper_stop.set()
+        if self._reaper is not None:
+            self._reaper.join(timeout=5)
+
+    def stats(self) -> dict:
+        with self._lru_lock:
+            loaded = len(self._lru[0]) + len(self._lru[1])
+        return {
+            "loaded_games": loaded,
+            "evicted_idle": self.evicted_idle,
+            "evicted_cap": self.evicted_cap,
+            "ttl": self.ttl,
+            "max_games": self.max_games,
+        }
+
+    def mutate(self, game_id: str, action: Callable[[], R]) -> R:
+        """Run action that changes the game in place, then bump its version and save it.
+
+        Mutations of one game run one at a time under its lock, so two quick
+        requests cannot both read the same state and apply on top of it.
+        An action that raises must leave the game as it was: then the version
+        stays and nothing is saved.
+        """
+        with self.locked(game_id):
+            result = action()
+            g = self.get(game_id)
+            if g is not None:
+                g.version += 1
+                self.save(g)
+            return result
+
+    def put(self, game: T) -> None:
+        """Insert a new game or replace an existing one"""
+        raise NotImplementedError
+
+    def put_many(self, games: Iterable[T]) -> None:
+        """put() for bulk loads; the SQLite stores write the whole batch in one transaction"""
+        for game in games:
+            self.put(game)
+
+    def replace(self, game: T, expected_version: int) -> None:
+        """Inside mutate(): swap in a changed copy of the game, saved like an in-place change.
+
+        expected_version is the version the copy was made from. The shared
+        store commits the copy only if the row still has that version;
+        otherwise mutate() runs the action again on the fresh game.
+        """
+        raise NotImplementedError
+
+    def save(self, game: T) -> None:
+        """Mark a game as modified in place"""
+        raise NotImplementedError
+
+    def delete(self, game_id: str) -> bool:
+        raise NotImplementedError
+
+    def loaded(self) -> List[T]:
+        """Games currently held in memory"""
+        raise NotImplementedError
+
+    def scan(self) -> Iterator[T]:
+        """Every stored game, also those not in memory; games read from disk are not cached"""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        self.stop_reaper()
+
+
+class MemoryGameStore(GameStore[T]):
+    """Games live only in process memory"""
+
+    def __init__(self, **eviction):
+        super().__init__(**eviction)
+        self._games: Dict[str, T] = {}
+
+    def get(self, game_id: str) -> Optional[T]:
+        g = self._games.get(game_id)
+        if g is not None:
+            self.touch(g)
+        return g
+
+    def put(self, game: T) -> None:
+        current = self._games.get(game.game_id)
+        if current is not game:
+            advance_version(game, current.version if current is not None else None)
+        self._games[game.game_id] = game
+        self.touch(game)
+        self.enforce_cap(keep=game.game_id)
+
+    def replace(self, game: T, expected_version: int) -> None:
+        # Only mutations under the game lock change it, the version cannot have moved
+        game.version = expected_version
+        self._games[game.game_id] = game
+
+    def save(self, game: T) -> None:
+        # The object in the dict was mutated in place; only its rank may change
+        if self._games.get(game.game_id) is game:
+            self.touch(game)
+
+    def delete(self, game_id: str) -> bool:
+        self.forget(game_id)
+        return self._games.pop(game_id, None) is not None
+
+    def _unload(self, game_id: str) -> None:
+        self._games.pop(game_id, None)
+
+    def loaded(self) -> List[T]:
+        return list(self._games.values())
+
+    def scan(self) -> Iterator[T]:
+        return iter(self.loaded())
+
+    def __len__(self) -> int:
+        return len(self._games)
+
+
+class SqliteGameStore(GameStore[T]):
+    """In-memory games with batched background writes to SQLite (WAL).
+
+    save() only marks a game dirty; a writer thread collects dirty games for
+    flush_interval seconds and commits them in a single transaction, so hot
+    endpoints (night_action, day_vote) never wait for fsync.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        encode: Callable[[T], str],
+        decode: Callable[[str], T],
+        flush_interval: float = 0.05,
+        history: Optional[History[T]] = None,
+        **eviction,
+    ):
+        super().__init__(**eviction)
+        self.path = path
+        self._encode = encode
+        self._decode = decode
+        self._flush_interval = flush_interval
+        self._history = history
+
+        self._cache: Dict[str, T] = {}
+        self._dirty: Set[str] = set()
+        self._deleted: Set[str] = set()
+        # History written so far (events, snapshots) per cached game; put() games rewrite all of it
+        self._saved: Dict[str, Tuple[int, int]] = {}
+        self._replaced: Set[str] = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+
+        # Separate connections so cache misses do not wait for the writer
+        self._db = connect(path)
+        self._writer_db = connect(path)
+        self._db.execute(SCHEMA)
+        if history is not None:
+            create_history(self._db)
+
+        self._writer = threading.Thread(target=self._writer_loop, name="game-store-writer", daemon=True)
+        self._writer.start()
+
+    # ---- reads ----
+    def get(self, game_id: str) -> Optional[T]:
+        with self._lock:
+            g = self._cache.get(game_id)
+            if g is None:
+                if game_id in self._deleted:
+                    return None
+                row = self._db.execute("SELECT data FROM games WHERE game_id = ?", (game_id,)).fetchone()
+                if row is None:
+                    return None
+                g = self._decode(row[0])
+                if self._history is not None:
+                    # The writer commits a game's row and history together, so they match
+                    self._saved[game_id] = attach_history(self._history, g, history_rows(self._db, game_id))
+                self._cache[game_id] = g
+        self.touch(g)
+        return g
+
+    def __len__(self) -> int:
+        self.flush()
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+    def scan(self) -> Iterator[T]:
+        self.flush()
+        last = ""
+        while True:
+            with self._lock:
+                # A page and the history of its games in one read transaction
+                self._db.execute("BEGIN")
+                try:
+                    rows = self._db.execute(
+                        "SELECT game_id, data FROM games WHERE game_id > ? ORDER BY game_id LIMIT ?", (last, SCAN_PAGE)
+                    ).fetchall()
+                    if self._history is not None:
+                        history = {game_id: history_rows(self._db, game_id) for game_id, _ in rows}
+                finally:
+                    self._db.execute("COMMIT")
+            if not rows:
+                return
+            for game_id, data in rows:
+                with self._lock:
+                    # The cached game may have changes the row does not have yet
+                    g = self._cache.get(game_id)
+                    deleted = game_id in self._deleted
+                if deleted:
+                    continue
+                if g is None:
+                    g = self._decode(data)
+                    if self._history is not None:
+                        attach_history(self._history, g, history[game_id])
+                yield g
+            last = rows[-1][0]
+
+    # ---- writes ----
+    def _stored_version(self, game_id: str) -> Optional[int]:
+        """Under self._lock: version of the game in the cache, else of its row; None if there is none"""
+        cached = self._cache.get(game_id)
+        if cached is not None:
+            return cached.version
+        row = self._db.execute("SELECT version FROM games WHERE game_id = ?", (game_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, game: T) -> None:
+        with self._lock:
+            if self._cache.get(game.game_id) is not game:
+                advance_version(game, self._stored_version(game.game_id))
+            self._cache[game.game_id] = game
+            self._deleted.discard(game.game_id)
+            self._dirty.add(game.game_id)
+            self._replaced.add(game.game_id)
+        self._wakeup.set()
+        self.touch(game)
+        self.enforce_cap(keep=game.game_id)
+
+    def put_many(self, games: Iterable[T]) -> None:
+        games = list(games)
+        with self._flush_lock:
+            with self._lock:
+                for g in games:
+                    if self._cache.get(g.game_id) is not g:
+                        advance_version(g, self._stored_version(g.game_id))
+                    if g.game_id in self._cache:
+                        self._cache[g.game_id] = g
+                    self._deleted.discard(g.game_id)
+                    self._dirty.discard(g.game_id)
+                    self._replaced.discard(g.game_id)
+                rows = [(g.game_id, g.version, self._encode(g), time.time()) for g in games]
+                # Under both locks: neither a flush nor a cache miss sees the batch half-written
+                try:
+                    self._writer_db.execute("BEGIN")
+                    self._writer_db.executemany(
+                        "INSERT INTO games (game_id, version, data, updated_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(game_id) DO UPDATE SET "
+                        "version = excluded.version, data = excluded.data, updated_at = excluded.updated_at",
+                        rows,
+                    )
+                    saved = {}
+                    if self._history is not None:
+                        delete_history(self._writer_db, [g.game_id for g in games])
+                        for g in games:
+                            saved[g.game_id] = write_history(self._writer_db, self._history, g, (0, 0))
+                    self._writer_db.execute("COMMIT")
+                except sqlite3.Error:
+                    if self._writer_db.in_transaction:
+                        self._writer_db.execute("ROLLBACK")
+                    raise
+                for game_id, counts in saved.items():
+                    if game_id in self._cache:
+                        self._saved[game_id] = counts
+
+    def replace(self, game: T, expected_version: int) -> None:
+        game.version = expected_version
+        with self._lock:
+            self._cache[game.game_id] = game
+
+    def save(self, game: T) -> None:
+        with self._lock:
+            cached = self._cache.get(game.game_id) is game
+            if cached:
+                self._dirty.add(game.game_id)
+        self._wakeup.set()
+        if cached:
+            self.touch(game)
+
+    def delete(self, game_id: str) -> bool:
+        self.forget(game_id)
+        with self._lock:
+            existed = self._cache.pop(game_id, None) is not None
+            self._saved.pop(game_id, None)
+            self._replaced.discard(game_id)
+            if not existed and game_id not in self._deleted:
+                existed = self._db.execute(
+                    "SELECT 1 FROM games WHERE game_id = ?", (game_id,)
+                ).fetchone() is not None
+            self._dirty.discard(game_id)
+            if existed:
+                self._deleted.add(game_id)
+        self._wakeup.set()
+        return existed
+
+    def flush(self) -> None:
+        """Write all pending changes in one transaction"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty and not self._deleted:
+                    return
+                rows = []
+                games = []
+                for gid in list(self._dirty):
+                    try:
+                        g = self._cache[gid]
+                        rows.append((gid, g.version, self._encode(g), time.time()))
+                    except RuntimeError:
+                        # Being mutated right now, retry on the next flush
+                        continue
+                    games.append(g)
+                    self._dirty.discard(gid)
+                replaced = [gid for gid, *_ in rows if gid in self._replaced]
+                self._replaced.difference_update(replaced)
+                saved = {g.game_id: (0, 0) if g.game_id in replaced else self._saved.get(g.game_id, (0, 0))
+                         for g in games}
+                deleted = list(self._deleted)
+
+            try:
+                self._writer_db.execute("BEGIN")
+                if deleted:
+                    self._writer_db.executemany("DELETE FROM games WHERE game_id = ?", [(gid,) for gid in deleted])
+                if rows:
+                    self._writer_db.executemany(
+                        "INSERT INTO games (game_id, version, data, updated_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(game_id) DO UPDATE SET "
+                        "version = excluded.version, data = excluded.data, updated_at = excluded.updated_at",
+                        rows,
+                    )
+                if self._history is not None:
+                    delete_history(self._writer_db, deleted + replaced)
+                    for g in games:
+                        saved[g.game_id] = write_history(self._writer_db, self._history, g, saved[g.game_id])
+                self._writer_db.execute("COMMIT")
+            except sqlite3.Error:
+                if self._writer_db.in_transaction:
+                    self._writer_db.execute("ROLLBACK")
+                with self._lock:
+                    self._dirty.update(row[0] for row in rows if row[0] in self._cache)
+                    self._replaced.update(gid for gid in replaced if gid in self._cache)
+                raise
+
+            with self._lock:
+                # Until the delete is committed get() must not reload the row
+                self._deleted.difference_update(deleted)
+                for gid, counts in saved.items():
+                    if gid in self._cache:
+                        self._saved[gid] = counts
+
+    def _unload(self, game_id: str) -> None:
+        # The row stays; pending changes must reach it before the cache entry goes
+        if game_id in self._dirty:
+            self.flush()
+        with self._lock:
+            if game_id not in self._dirty:
+                self._cache.pop(game_id, None)
+                self._saved.pop(game_id, None)
+
+    def loaded(self) -> List[T]:
+        with self._lock:
+            return list(self._cache.values())
+
+    def _writer_loop(self):
+        while not self._stopped:
+            self._wakeup.wait()
+            # A short pause batches clicks from many games into one commit
+            time.sleep(self._flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"[store] SQLite write failed: {e}")
+
+    def close(self) -> None:
+        self.stop_reaper()
+        self._stopped = True
+        self._wakeup.set()
+        self._writer.join(timeout=5)
+        self.flush()
+        self._writer_db.close()
+        self._db.close()
+
+
+class SharedSqliteGameStore(GameStore[T]):
+    """SQLite store shared by several worker processes (uvicorn --workers N).
+
+    Every row carries the game version. Reads reuse the cached object while
+    its version matches the row and reload it otherwise. Mutations commit
+    synchronously with compare-and-swap on the version; if another worker
+    got there first, the action is replayed on the fresh state. A worker
+    learns about changes made by the others only when it reads the game;
+    changed() lets it look for them (the WebSocket hub polls it).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        encode: Callable[[T], str],
+        decode: Callable[[str], T],
+        max_retries: int = 5,
+        history: Optional[History[T]] = None,
+        **eviction,
+    ):
+        super().__init__(**eviction)
+        self.path = path
+        self._encode = encode
+        self._decode = decode
+        self._max_retries = max_retries
+        self._history = history
+
+        self._cache: Dict[str, T] = {}
+        # History committed so far (events, snapshots) per cached game
+        self._saved: Dict[str, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = []
+
+        self._conn().execute(SCHEMA)
+        if history is not None:
+            create_history(self._conn())
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shared between threadpool threads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = connect(self.path)
+            self._local.db = db
+            with self._lock:
+                self._connections.append(db)
+        return db
+
+    def get(self, game_id: str) -> Optional[T]:
+        with self._lock:
+            cached = self._cache.get(game_id)
+        cached_version = cached.version if cached is not None else -1
+        db = self._conn()
+        row: Optional[Tuple[int, Optional[str]]] = db.execute(
+            "SELECT version, CASE WHEN version = ? THEN NULL ELSE data END FROM games WHERE game_id = ?",
+            (cached_version, game_id),
+        ).fetchone()
+        history = None
+        if row is not None and row[1] is not None and self._history is not None:
+            # Read the row again with its history in one read transaction, so they match
+            db.execute("BEGIN")
+            try:
+                row = db.execute("SELECT version, data FROM games WHERE game_id = ?", (game_id,)).fetchone()
+                history = history_rows(db, game_id)
+            finally:
+                db.execute("COMMIT")
+        if row is None:
+            with self._lock:
+                self._cache.pop(game_id, None)
+                self._saved.pop(game_id, None)
+            return None
+        if row[1] is None:
+            self.touch(cached)
+            return cached
+        g = self._decode(row[1])
+        g.version = row[0]
+        saved = attach_history(self._history, g, history) if history is not None else (0, 0)
+        with self._lock:
+            self._cache[game_id] = g
+            self._saved[game_id] = saved
+        self.touch(g)
+        return g
+
+    def mutate(self, game_id: str, action: Callable[[], R]) -> R:
+        # The game lock serializes this process; other workers are caught by the version check
+        with self.locked(game_id):
+            return self._mutate(game_id, action)
+
+    def _mutate(self, game_id: str, action: Callable[[], R]) -> R:
+        for _ in range(self._max_retries):
+            try:
+                result = action()
+            except Exception:
+                # Nothing to commit; but the action may have failed on a state another worker has changed since
+                if self._current(game_id):
+                    raise
+            else:
+                if self._commit(game_id):
+                    return result
+            with self._lock:
+                self._cache.pop(game_id, None)
+        raise StoreConflict(game_id)
+
+    def _current(self, game_id: str) -> bool:
+        """Whether the cached game still has the version of its row"""
+        with self._lock:
+            g = self._cache.get(game_id)
+        if g is None:
+            return True
+        row = self._conn().execute("SELECT version FROM games WHERE game_id = ?", (game_id,)).fetchone()
+        return row is not None and row[0] == g.version
+
+    def _commit(self, game_id: str) -> bool:
+        with self._lock:
+            g = self._cache.get(game_id)
+            saved = self._saved.get(game_id, (0, 0))
+        if g is None:
+            return True
+        expected = g.version
+        g.version += 1
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            cur = db.execute(
+                "UPDATE games SET version = ?, data = ?, updated_at = ? WHERE game_id = ? AND version = ?",
+                (g.version, self._encode(g), time.time(), game_id, expected),
+            )
+            # The row had the version this game was read at, so its history ends where `saved` says
+            if cur.rowcount == 1 and self._history is not None:
+                saved = write_history(db, self._history, g, saved)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            g.version = expected
+            raise
+        if cur.rowcount == 1:
+            with self._lock:
+                self._saved[game_id] = saved
+            self.touch(g)
+            return True
+        g.version = expected
+        return False
+
+    def _put_rows(self, db: sqlite3.Connection, games: List[T]) -> Dict[str, Tuple[int, int]]:
+        """Inside a write transaction: upsert the rows, replace their history; returns the saved counts"""
+        db.executemany(
+            "INSERT INTO games (game_id, version, data, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(game_id) DO UPDATE SET "
+            "version = max(excluded.version, games.version + 1), data = excluded.data, "
+            "updated_at = excluded.updated_at",
+            [(g.game_id, g.version, self._encode(g), time.time()) for g in games],
+        )
+        saved = {}
+        if self._history is not None:
+            delete_history(db, [g.game_id for g in games])
+            for g in games:
+                saved[g.game_id] = write_history(db, self._history, g, (0, 0))
+        return saved
+
+    def put(self, game: T) -> None:
+        # Replacing a game (reset) must still move the version forward for other workers.
+        # The version column is authoritative, the copy inside data may lag behind.
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            saved = self._put_rows(db, [game])
+            version = db.execute("SELECT version FROM games WHERE game_id = ?", (game.game_id,)).fetchone()[0]
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        game.version = version
+        with self._lock:
+            self._cache[game.game_id] = game
+            self._saved[game.game_id] = saved.get(game.game_id, (0, 0))
+        self.touch(game)
+        self.enforce_cap(keep=game.game_id)
+
+    def put_many(self, games: Iterable[T]) -> None:
+        games = list(games)
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            self._put_rows(db, games)
+            db.execute("COMMIT")
+        except sqlite3.Error:
+            db.execute("ROLLBACK")
+            raise
+        # Versions may have moved forward: the next get() reloads the rows
+        with self._lock:
+            for g in games:
+                self._cache.pop(g.game_id, None)
+                self._saved.pop(g.game_id, None)
+        for g in games:
+            self.forget(g.game_id)
+
+    def replace(self, game: T, expected_version: int) -> None:
+        # _commit writes the cached game with compare-and-swap on its version
+        game.version = expected_version
+        with self._lock:
+            self._cache[game.game_id] = game
+
+    def save(self, game: T) -> None:
+        self._commit(game.game_id)
+
+    def delete(self, game_id: str) -> bool:
+        self.forget(game_id)
+        with self._lock:
+            self._cache.pop(game_id, None)
+            self._saved.pop(game_id, None)
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            cur = db.execute("DELETE FROM games WHERE game_id = ?", (game_id,))
+            if self._history is not None:
+                delete_history(db, [game_id])
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return cur.rowcount > 0
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+    def scan(self) -> Iterator[T]:
+        last = ""
+        db = self._conn()
+        while True:
+            games = []
+            # A page and its history in one read transaction
+            db.execute("BEGIN")
+            try:
+                rows = db.execute(
+                    "SELECT game_id, version, data FROM games WHERE game_id > ? ORDER BY game_id LIMIT ?",
+                    (last, SCAN_PAGE),
+                ).fetchall()
+                for _, version, data in rows:
+                    g = self._decode(data)
+                    g.version = version
+                    if self._history is not None:
+                        attach_history(self._history, g, history_rows(db, g.game_id))
+                    games.append(g)
+            finally:
+                db.execute("COMMIT")
+            if not rows:
+                return
+            yield from games
+            last = rows[-1][0]
+
+    def changed(self, game_ids: List[str]) -> List[str]:
+        """Games among game_ids that another worker changed or deleted since this one last read them.
+
+        Compares row versions with the cached games; a game that is not
+        cached counts as changed while its row exists, get() caches it again.
+        """
+        rows: Dict[str, int] = {}
+        db = self._conn()
+        for i in range(0, len(game_ids), SCAN_PAGE):
+            page = game_ids[i:i + SCAN_PAGE]
+            rows.update(db.execute(
+                f"SELECT game_id, version FROM games WHERE game_id IN ({','.join('?' * len(page))})", page
+            ).fetchall())
+        with self._lock:
+            cached = {game_id: self._cache[game_id].version for game_id in game_ids if game_id in self._cache}
+        return [
+            game_id for game_id in game_ids
+            # A row behind the cache is a commit of this worker in progress, not a change
+            if (game_id in rows and rows[game_id] > cached.get(game_id, -1))
+            or (game_id not in rows and game_id in cached)
+        ]
+
+    def _unload(self, game_id: str) -> None:
+        with self._lock:
+            self._cache.pop(game_id, None)
+            self._saved.pop(game_id, None)
+
+    def loaded(self) -> List[T]:
+        with self._lock:
+            return list(self._cache.values())
+
+    def close(self) -> None:
+        self.stop_reaper()
+        with self._lock:
+            for db in self._connections:
+                db.close()
+            self._connections.clear()